@@ -1,6 +1,7 @@
 """An example of how to use Capital Asset Pricing Model (CAPM)"""
 
 import numpy as np
+import pandas as pd
 from scipy.optimize import fsolve
 
 
@@ -28,13 +29,14 @@ def compute_portfolio_return(weights, alphas, betas, market_return):
     
     Parameters:
     weights: A list of weights for stocks in the portfolio
-    alphas: A list of betas for stocks in the portfolio
-    betas: A list of betas for stocks in the portfolio 
+    alphas: A list of alphas for stocks in the portfolio, e.g. a column of estimate_capm
+    betas: A list of betas for stocks in the portfolio, e.g. a column of estimate_capm
     market_return: Return rate of the market (e.g. SP500) on a particular day
 
     Returns: 
     portfolio_return: Return rate of the stock on a particular day
     """
+    alphas, betas = np.asarray(alphas), np.asarray(betas)
     portfolio_return = sum([(betas[i] * market_return + alphas[i]) * weights[i] for i in range(len(weights))])
     return portfolio_return
 
@@ -55,6 +57,54 @@ def compute_portfolio_return2(weights, stock_returns):
     return portfolio_return
 
 
+def estimate_capm(prices, market_sym="SPY"):
+    """
+    Estimate alpha and beta of every symbol by regressing its daily returns on those of 
+    the market. All symbols are fitted at once with the closed-form least-squares 
+    solution, beta = cov(stock, market) / var(market) and alpha = mean(stock) - beta * 
+    mean(market), each over the days on which both returns are known
+
+    Parameters:
+    prices: A dataframe of adjusted closing prices with dates as indices and symbols, 
+    including the market, as columns
+    market_sym: Symbol of the market (e.g. SP500)
+
+    Returns:
+    df_capm: A dataframe with one row per symbol other than the market and columns alpha 
+    (daily), beta, residual_vol (standard deviation of the daily residual returns) and 
+    r_squared. Its alpha and beta columns can be passed to compute_stock_return and 
+    compute_portfolio_return
+    """
+
+    symbols = [symbol for symbol in prices.columns if symbol != market_sym]
+    values = prices[symbols].values
+    market_values = prices[market_sym].values
+    stock_returns = values[1:] / values[:-1] - 1
+    market_returns = (market_values[1:] / market_values[:-1] - 1)[:, None]
+
+    # Days on which both the symbol's and the market's returns are known
+    valid = ~np.isnan(stock_returns) & ~np.isnan(market_returns)
+    num_days = valid.sum(axis=0)
+    x = np.where(valid, market_returns, 0.0)
+    y = np.where(valid, stock_returns, 0.0)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        x_mean = x.sum(axis=0) / num_days
+        y_mean = y.sum(axis=0) / num_days
+        x_centered = np.where(valid, x - x_mean, 0.0)
+        y_centered = np.where(valid, y - y_mean, 0.0)
+        beta = (x_centered * y_centered).sum(axis=0) / (x_centered ** 2).sum(axis=0)
+        alpha = y_mean - beta * x_mean
+
+        residuals = y_centered - beta * x_centered
+        residual_ss = (residuals ** 2).sum(axis=0)
+        residual_vol = np.sqrt(residual_ss / (num_days - 2))
+        r_squared = 1 - residual_ss / (y_centered ** 2).sum(axis=0)
+
+    return pd.DataFrame({"alpha": alpha, "beta": beta, "residual_vol": residual_vol,
+        "r_squared": r_squared}, index=symbols)
+
+
 def weight_function_for_min_risk(weight_variables, betas):
     """
     A function of weights of stocks in a portfolio to remove market risk, i.e. 
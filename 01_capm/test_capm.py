@@ -0,0 +1,53 @@
+"""Test for capm.py"""
+
+
+from capm import estimate_capm, compute_portfolio_return
+import unittest
+import numpy as np
+import pandas as pd
+
+
+class TestEstimateCapm(unittest.TestCase):
+
+    def setUp(self):
+        # Stocks following the market with known alphas and betas, with NAN gaps in the
+        # prices of the stocks and of the market
+        rng = np.random.default_rng(0)
+        market_returns = rng.normal(0.0004, 0.01, 300)
+        stock_returns = 0.0002 * np.arange(1, 4) + market_returns[:, None] * [0.5, 1.0, 1.8] + \
+            rng.normal(0, 0.005, (300, 3))
+        returns = np.column_stack((stock_returns, market_returns))
+        self.prices = pd.DataFrame(100 * np.cumprod(1 + returns, axis=0),
+            pd.date_range("2011-01-03", periods=300), ["AAA", "BBB", "CCC", "SPY"])
+        self.prices.iloc[10:25, 0] = np.nan
+        self.prices.iloc[200, 1] = np.nan
+        self.prices.iloc[[50, 120], 3] = np.nan
+
+    def test_matches_polyfit(self):
+        df_capm = estimate_capm(self.prices)
+        self.assertEqual(df_capm.index.tolist(), ["AAA", "BBB", "CCC"])
+
+        daily_returns = self.prices.pct_change(fill_method=None)
+        for symbol in df_capm.index:
+            valid = daily_returns[symbol].notnull() & daily_returns["SPY"].notnull()
+            x = daily_returns["SPY"][valid].values
+            y = daily_returns[symbol][valid].values
+            beta, alpha = np.polyfit(x, y, 1)
+            residuals = y - (alpha + beta * x)
+            self.assertAlmostEqual(df_capm.loc[symbol, "beta"], beta, places=12)
+            self.assertAlmostEqual(df_capm.loc[symbol, "alpha"], alpha, places=14)
+            self.assertAlmostEqual(df_capm.loc[symbol, "residual_vol"],
+                np.std(residuals, ddof=2), places=14)
+            self.assertAlmostEqual(df_capm.loc[symbol, "r_squared"], np.corrcoef(x, y)[0, 1] ** 2,
+                places=12)
+
+    def test_feeds_compute_portfolio_return(self):
+        df_capm = estimate_capm(self.prices)
+        portfolio_return = compute_portfolio_return([0.5, 0.3, 0.2], df_capm["alpha"],
+            df_capm["beta"], 0.01)
+        expected = np.dot([0.5, 0.3, 0.2], df_capm["alpha"].values + df_capm["beta"].values * 0.01)
+        self.assertAlmostEqual(portfolio_return, expected, places=15)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,6 +4,7 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
 import datetime as dt
+from scipy.optimize import minimize
 import sys
 # Append the path of the directory one level above the current directory to import util
 sys.path.append('../')
@@ -55,7 +56,7 @@ def assess_portfolio(sd = dt.datetime(2008,1,1), ed = dt.datetime(2009,1,1), \
         plot_normalized_data(df_temp, title="Daily portfolio and SPY", xlabel="Date", ylabel="Normalized price")    
 
     # Compute end value
-    ev = port_val.ix[-1, 0]
+    ev = port_val.iloc[-1, 0]
 
     return cr, adr, sddr, sr, ev
 
@@ -87,30 +88,260 @@ def get_portfolio_value(prices, allocs, sv):
     return port_val
 
 
-def get_portfolio_stats(port_val, daily_rf, samples_per_year):
+def get_portfolio_stats(port_val, daily_rf, samples_per_year, single_pass=False, block_size=4096):
     """Helper function to compute portfolio statistics
 
     Parameters:
-    port_val: A dataframe object showing the portfolio value for each day
+    port_val: A dataframe object showing the portfolio value for each day, or a numpy 
+    ndarray or dataframe with one column per portfolio
     daily_rf: Daily risk-free rate, assuming it does not change
     samples_per_year: Sampling frequency per year
+    single_pass: If True, compute the daily returns and their mean and variance one block 
+    of days at a time, merging the blocks with Chan's parallel update, so that very long 
+    series are read once and the daily returns are never held in memory in full
+    block_size: Number of days per block if single_pass
     
     Returns:
     cr: Cumulative return
     adr: Average daily return
     sddr: Standard deviation of daily return
     sr: Sharpe ratio
+    Each is a number for a one-column dataframe or a 1-D array, and otherwise a numpy 
+    ndarray with one value per portfolio. As with pandas, NAN daily returns are skipped
     """
-    cr = port_val.iloc[-1, 0]/port_val.iloc[0, 0] - 1
-
-    daily_returns = compute_daily_returns(port_val)[1:]
-    adr = daily_returns.iloc[:, 0].mean()
-    sddr = daily_returns.iloc[:, 0].std()
+    values = np.asarray(port_val, dtype=float)
+    one_portfolio = values.ndim == 1 or (isinstance(port_val, pd.DataFrame) and values.shape[1] == 1)
+    values = values.reshape(len(values), -1)
+
+    cr = values[-1] / values[0] - 1
+
+    if single_pass:
+        adr, sddr = _get_return_moments(values, block_size)
+    else:
+        daily_returns = values[1:] / values[:-1] - 1
+        adr = np.nanmean(daily_returns, axis=0)
+        sddr = np.nanstd(daily_returns, axis=0, ddof=1)
     sr = compute_sharpe_ratio(np.sqrt(samples_per_year), adr, daily_rf, sddr)
 
+    if one_portfolio:
+        return cr[0], adr[0], sddr[0], sr[0]
     return cr, adr, sddr, sr
 
 
+def _get_return_moments(values, block_size):
+    """Compute the mean and standard deviation of the daily returns of each column of 
+    values, one block of days at a time"""
+    count = np.zeros(values.shape[1])
+    mean = np.zeros(values.shape[1])
+    m2 = np.zeros(values.shape[1])
+    for start in range(0, len(values) - 1, block_size):
+        block = values[start:start + block_size + 1]
+        daily_returns = block[1:] / block[:-1] - 1
+        valid = ~np.isnan(daily_returns)
+        block_count = valid.sum(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            block_mean = np.where(valid, daily_returns, 0.0).sum(axis=0) / block_count
+            block_m2 = (np.where(valid, daily_returns - block_mean, 0.0) ** 2).sum(axis=0)
+            total = count + block_count
+            delta = np.where(block_count > 0, block_mean - mean, 0.0)
+            mean = np.where(total > 0, mean + delta * block_count / total, 0.0)
+            m2 = m2 + np.where(block_count > 0, block_m2, 0.0) + \
+                np.where(total > 0, delta ** 2 * count * block_count / total, 0.0)
+        count = total
+    with np.errstate(invalid="ignore", divide="ignore"):
+        adr = np.where(count > 0, mean, np.nan)
+        sddr = np.where(count > 1, np.sqrt(m2 / (count - 1)), np.nan)
+    return adr, sddr
+
+
+def get_portfolio_values(prices, allocs, sv):
+    """Helper function to compute the values of many portfolios at once
+
+    Parameters:
+    prices: Adjusted closing prices for portfolio symbols
+    allocs: A 2-D array-like with one allocation vector per row, in the order of the 
+    columns of prices
+    sv: Start value of the portfolios
+    
+    Returns:
+    port_vals: A numpy ndarray with one row per day and one column per allocation vector
+    """
+
+    # Normalize the prices according to the first day, then weight them by all the 
+    # allocations with a single matrix product
+    norm_prices = normalize_data(prices).values
+    return norm_prices.dot(np.asarray(allocs, dtype=float).T) * sv
+
+
+def assess_allocations(prices, allocs, sv=1000000, rfr=0.0, sf=252.0, batch_size=10000):
+    """Assess many allocations of the same symbols over prices that are already loaded
+
+    Parameters:
+    prices: Adjusted closing prices for portfolio symbols
+    allocs: A 2-D array-like with one allocation vector per row
+    sv: Start value of the portfolios
+    rfr: The risk free return per sample period for the entire date range, assuming it does not change
+    sf: Sampling frequency per year
+    batch_size: Number of allocation vectors whose values are held in memory at a time
+
+    Returns:
+    cr: A numpy ndarray of cumulative returns, one per allocation vector
+    adr: A numpy ndarray of average period returns
+    sddr: A numpy ndarray of standard deviations of daily return
+    sr: A numpy ndarray of Sharpe ratios
+    ev: A numpy ndarray of end values
+    """
+
+    allocs = np.atleast_2d(np.asarray(allocs, dtype=float))
+    results = []
+    for start in range(0, len(allocs), batch_size):
+        port_vals = get_portfolio_values(prices, allocs[start:start + batch_size], sv)
+        results.append(get_portfolio_stats(port_vals, rfr, sf) + (port_vals[-1],))
+    return tuple(np.concatenate(stat) for stat in zip(*results))
+
+
+def sample_efficient_frontier(prices, num_portfolios=10000, sv=1000000, rfr=0.0, sf=252.0,
+    batch_size=10000, seed=0):
+    """Sample random long-only allocations and find those on the efficient frontier
+
+    Allocations are drawn from Dirichlet distributions whose concentration varies from 
+    sample to sample, so that both concentrated portfolios near the ends of the frontier 
+    and diversified ones in between are covered. The single-symbol portfolios are always 
+    included
+
+    Parameters:
+    prices: Adjusted closing prices for portfolio symbols
+    num_portfolios: Number of random allocation vectors
+    sv: Start value of the portfolios
+    rfr: The risk free return per sample period for the entire date range, assuming it does not change
+    sf: Sampling frequency per year
+    batch_size: See assess_allocations
+    seed: Seed of the random generator
+
+    Returns:
+    df_frontier: A dataframe with one row per portfolio, the allocations in one column per 
+    symbol, then cr, adr, sddr, sr and frontier (True for portfolios that no other sampled 
+    portfolio beats with a higher average return for a lower or equal volatility)
+    """
+
+    num_symbols = prices.shape[1]
+    rng = np.random.default_rng(seed)
+    concentration = 10 ** rng.uniform(-1.5, 0.5, (num_portfolios, 1))
+    allocs = rng.gamma(concentration, size=(num_portfolios, num_symbols))
+    allocs[allocs.sum(axis=1) == 0] = 1.0
+    allocs = np.vstack((np.eye(num_symbols), allocs / allocs.sum(axis=1, keepdims=True)))
+
+    cr, adr, sddr, sr, ev = assess_allocations(prices, allocs, sv, rfr, sf, batch_size)
+
+    # Going from the least to the most volatile portfolio, a portfolio is on the frontier 
+    # if its average return is above that of all less volatile ones
+    order = np.argsort(sddr, kind="mergesort")
+    best_so_far = np.maximum.accumulate(adr[order])
+    frontier = np.zeros(len(allocs), dtype=bool)
+    frontier[order] = adr[order] >= best_so_far
+
+    df_frontier = pd.DataFrame(allocs, columns=prices.columns)
+    df_frontier["cr"] = cr
+    df_frontier["adr"] = adr
+    df_frontier["sddr"] = sddr
+    df_frontier["sr"] = sr
+    df_frontier["frontier"] = frontier
+    return df_frontier
+
+
+def optimize_portfolio(prices, objective="sharpe", bounds=(0.0, 1.0), sv=1000000, rfr=0.0, sf=252.0):
+    """Find the allocations that maximize the Sharpe ratio or minimize the volatility
+
+    The portfolio is bought and held, as in assess_portfolio: its value on each day is the 
+    normalized prices times the allocations, so its daily returns are not a fixed mix of 
+    the symbols' daily returns. The normalized prices are computed once, and SLSQP is 
+    given the analytic gradients of the Sharpe ratio and of the variance of the portfolio's 
+    daily returns, under the constraints that allocations sum to 1.0 and stay within 
+    bounds. The statistics of the chosen allocations are then computed as assess_portfolio 
+    does
+
+    Parameters:
+    prices: Adjusted closing prices for portfolio symbols, without NAN's
+    objective: "sharpe" to maximize the Sharpe ratio or "volatility" to minimize the 
+    standard deviation of daily return
+    bounds: A (min, max) pair for all allocations, or a list of one pair per symbol
+    sv: Start value of the portfolio
+    rfr: The risk free return per sample period for the entire date range, assuming it does not change
+    sf: Sampling frequency per year
+
+    Returns:
+    allocs: A numpy ndarray of allocations, in the order of the columns of prices
+    cr: Cumulative return
+    adr: Average period return (if sf == 252 this is daily return)
+    sddr: Standard deviation of daily return
+    sr: Sharpe ratio
+    Raise RuntimeError if SLSQP does not converge
+    """
+
+    if prices.isnull().values.any():
+        raise ValueError("prices contain NAN's; fill them before optimizing")
+    num_symbols = prices.shape[1]
+    if np.ndim(bounds) == 1:
+        bounds = [tuple(bounds)] * num_symbols
+    lows, highs = np.array(bounds, dtype=float).T
+    if lows.sum() > 1.0 or highs.sum() < 1.0:
+        raise ValueError("No allocations within bounds sum to 1.0")
+
+    # Normalized prices, shared by every evaluation
+    norm_prices = normalize_data(prices).values
+    num_returns = len(norm_prices) - 1
+    k = np.sqrt(sf)
+
+    def get_returns(allocs):
+        """Return the centered daily returns of the portfolio, their mean, and the gradient 
+        of each daily return with respect to the allocations"""
+        # port_val[t] = norm_prices[t] . allocs, so the gradient of 
+        # port_val[t] / port_val[t - 1] - 1 is 
+        # (norm_prices[t] * port_val[t - 1] - norm_prices[t - 1] * port_val[t]) / port_val[t - 1] ** 2
+        port_val = norm_prices.dot(allocs)
+        daily_returns = port_val[1:] / port_val[:-1] - 1
+        grad_returns = (norm_prices[1:] * port_val[:-1, None] -
+            norm_prices[:-1] * port_val[1:, None]) / port_val[:-1, None] ** 2
+        adr = daily_returns.mean()
+        return daily_returns - adr, adr, grad_returns
+
+    if objective == "sharpe":
+        def fun(allocs):
+            centered, adr, grad_returns = get_returns(allocs)
+            sd = np.sqrt(centered.dot(centered) / (num_returns - 1))
+            # The mean of the centered returns is zero, so the mean drops out of the 
+            # gradient of the standard deviation
+            grad_adr = grad_returns.mean(axis=0)
+            grad_sd = centered.dot(grad_returns) / ((num_returns - 1) * sd)
+            value = -k * (adr - rfr) / sd
+            grad = -k * (grad_adr / sd - (adr - rfr) * grad_sd / sd ** 2)
+            return value, grad
+    elif objective == "volatility":
+        # The variance is scaled to order one so that SLSQP's tolerance is meaningful
+        scale = 1.0 / np.mean(np.var(norm_prices[1:] / norm_prices[:-1] - 1, axis=0, ddof=1))
+        def fun(allocs):
+            centered, _, grad_returns = get_returns(allocs)
+            return scale * centered.dot(centered) / (num_returns - 1), \
+                2 * scale * centered.dot(grad_returns) / (num_returns - 1)
+    else:
+        raise ValueError("objective must be 'sharpe' or 'volatility', got {}".format(objective))
+
+    # Start from equal allocations, moved within bounds
+    start = np.clip(np.full(num_symbols, 1.0 / num_symbols), lows, highs)
+    constraints = {"type": "eq", "fun": lambda allocs: allocs.sum() - 1.0,
+        "jac": lambda allocs: np.ones(num_symbols)}
+    result = minimize(fun, start, jac=True, method="SLSQP", bounds=list(zip(lows, highs)),
+        constraints=constraints, options={"ftol": 1e-12, "maxiter": 1000})
+    if not result.success:
+        raise RuntimeError("The optimization did not converge: {}".format(result.message))
+    # SLSQP may step past a bound by rounding error
+    allocs = np.clip(result.x, lows, highs)
+
+    port_val = get_portfolio_value(prices, allocs, sv)
+    cr, adr, sddr, sr = get_portfolio_stats(port_val, rfr, sf)
+    return allocs, cr, adr, sddr, sr
+
+
 def plot_normalized_data(df, title, xlabel, ylabel, save_fig=False, fig_name="plot.png"):
     """Helper function to normalize and plot data"""
 
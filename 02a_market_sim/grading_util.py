@@ -6,7 +6,12 @@ All Rights Reserved
 """
 
 import os
+import sys
+import time
 import pandas as pd
+# Append the path of the directory one level above the current directory to import util
+sys.path.append('../')
+from util import map_tasks
 
 def symbol_to_path(symbol, base_dir=None):
     """Return CSV file path given ticker symbol."""
@@ -14,22 +19,39 @@ def symbol_to_path(symbol, base_dir=None):
         base_dir = os.environ.get("MARKET_DATA_DIR", '../data/')
     return os.path.join(base_dir, "{}.csv".format(str(symbol)))
 
-def get_data(symbols, dates, addSPY=True, colname = 'Adj Close'):
-    """Read stock data (adjusted close) for given symbols from CSV files."""
-    df = pd.DataFrame(index=dates)
+def get_data(symbols, dates, addSPY=True, colname = 'Adj Close', workers=1, executor="thread",
+    timings=None):
+    """Read stock data (adjusted close) for given symbols from CSV files.
+
+    With workers > 1 the files are read in a thread pool, or with executor="process" in a
+    process pool that also spreads the CSV parsing (see util.map_tasks). If timings is a
+    dict, it is filled with the seconds spent reading each symbol.
+    """
+    index = pd.DataFrame(index=dates).index
     if addSPY and 'SPY' not in symbols:  # add SPY for reference, if absent
         symbols = ['SPY'] + symbols
 
-    for symbol in symbols:
-        df_temp = pd.read_csv(symbol_to_path(symbol), index_col='Date',
-                parse_dates=True, usecols=['Date', colname], na_values=['nan'])
-        df_temp = df_temp.rename(columns={colname: symbol})
-        df = df.join(df_temp)
-        if symbol == 'SPY':  # drop dates SPY did not trade
-            df = df.dropna(subset=["SPY"])
+    results = map_tasks(_read_symbol, [(symbol, symbol_to_path(symbol), colname, index)
+        for symbol in symbols], workers, executor)
+    if timings is not None:
+        timings.update((symbol, seconds) for symbol, (_, seconds) in zip(symbols, results))
+
+    if len(results) == 0:
+        return pd.DataFrame(index=index)
+    df = pd.concat([column for column, _ in results], axis=1)
+    if 'SPY' in symbols:  # drop dates SPY did not trade
+        df = df.dropna(subset=["SPY"])
 
     return df
 
+def _read_symbol(task):
+    """Read the column colname of one symbol's CSV file on index, with the seconds it took"""
+    symbol, path, colname, index = task
+    start = time.time()
+    df_temp = pd.read_csv(path, index_col='Date',
+            parse_dates=True, usecols=['Date', colname], na_values=['nan'])
+    return df_temp[colname].reindex(index).rename(symbol), time.time() - start
+
 def plot_data(df, title="Stock prices", xlabel="Date", ylabel="Price"):
     import matplotlib.pyplot as plt
     """Plot stock prices with a custom title and meaningful axis labels."""
@@ -4,28 +4,38 @@ import pandas as pd
 import numpy as np
 import datetime as dt
 import os
+import shutil
+import heapq
+import collections
+import tempfile
 from analysis import get_portfolio_value, get_portfolio_stats, plot_normalized_data
+from rolling_analysis import get_max_drawdowns
 import sys
 # Append the path of the directory one level above the current directory to import util
 sys.path.append('../')
 from util import *
 
 
-def compute_portvals(orders_file = "./orders/orders.csv", start_val = 1000000, commission=9.95, impact=0.005):
+# Approximate cost of valuing one run of sparse holdings, in cells of dense holdings
+SPARSE_RUN_COST = 100
+
+
+def compute_portvals(orders_file = "./orders/orders.csv", start_val = 1000000, commission=9.95, impact=0.005,
+    holdings="auto"):
     """
     Parameters:
     orders_file: The name of a file from which to read orders; may be a string, or a file object
     start_val: The starting value of the portfolio (initial cash available)
     commission: The fixed amount in dollars charged for each transaction (both entry and exit)
     impact: The amount the price moves against the trader compared to the historical data at each transaction
+    holdings: "dense", "sparse" or "auto"; see compute_portvals_from_prices
     
     Returns:
     portvals: A dataframe with one column containing the value of the portfolio for each trading day
     """
 
     # Read in the orders_file and sort it by date
-    orders_df = pd.read_csv(orders_file, index_col='Date', parse_dates=True, na_values=['nan'])
-    orders_df.sort_index(ascending=True, inplace=True)
+    orders_df = read_orders(orders_file)
     
     # Get the start and end dates and symbols
     start_date = orders_df.index.min()
@@ -33,45 +43,101 @@ def compute_portvals(orders_file = "./orders/orders.csv", start_val = 1000000, c
     symbols = orders_df.Symbol.unique().tolist()
 
     # Create a dataframe with adjusted close prices for the symbols and for cash
-    df_prices = get_data(symbols, pd.date_range(start_date, end_date), addSPY=True)
-    del df_prices["SPY"]
-    df_prices["cash"] = 1.0
+    df_prices = get_prices(symbols, start_date, end_date)
 
-    # Fill NAN values if any
-    df_prices.fillna(method="ffill", inplace=True)
-    df_prices.fillna(method="bfill", inplace=True)
-    df_prices.fillna(1.0, inplace=True)
+    return compute_portvals_from_prices(orders_df, df_prices, start_val, commission, impact,
+        holdings)
+
+
+def compute_portvals_from_data(orders, data_dict, start_val=1000000, commission=9.95, impact=0.005,
+    holdings="auto", key="Adj Close"):
+    """
+    Compute the portfolio values of orders using prices that are already in memory, e.g. the 
+    data_dict an event study was run on, instead of reading an orders file and price files
+
+    Parameters:
+    orders: Orders in any form accepted by read_orders, e.g. the df_trades returned by 
+    output_events_as_trades
+    data_dict: A dictionary whose keys are types of data, e.g. Adj Close, Volume, etc. and 
+    values are dataframes with dates as indices and symbols as columns
+    start_val, commission, impact, holdings: See compute_portvals
+    key: The key of data_dict holding the prices used to value the portfolio
+
+    Returns:
+    portvals: A dataframe with one column containing the value of the portfolio for each trading day
+    """
+
+    orders_df = read_orders(orders)
+    start_date = orders_df.index.min()
+    end_date = orders_df.index.max()
+    symbols = orders_df.Symbol.unique().tolist()
+
+    df_prices = get_prices(symbols, start_date, end_date, df_all_prices=data_dict[key])
+
+    return compute_portvals_from_prices(orders_df, df_prices, start_val, commission, impact,
+        holdings)
+
+
+def read_orders(orders):
+    """
+    Read orders into a dataframe sorted by date
+
+    Parameters:
+    orders: The name of an orders file or a file object; a dataframe with Symbol, Order and 
+    Shares columns and either dates as indices or a Date column; or an array-like whose 
+    rows are [Date, Symbol, Order, Shares]
+
+    Returns:
+    orders_df: A dataframe with dates as indices and Symbol, Order and Shares columns
+    """
+
+    if isinstance(orders, pd.DataFrame):
+        orders_df = orders.copy()
+        if "Date" in orders_df.columns:
+            orders_df = orders_df.set_index("Date")
+        orders_df.index = pd.to_datetime(orders_df.index)
+    elif isinstance(orders, str) or hasattr(orders, "read"):
+        orders_df = pd.read_csv(orders, index_col='Date', parse_dates=True, na_values=['nan'])
+    else:
+        orders_df = pd.DataFrame(list(orders), columns=["Date", "Symbol", "Order", "Shares"])
+        orders_df["Date"] = pd.to_datetime(orders_df["Date"])
+        orders_df = orders_df.set_index("Date")
+    orders_df.index.name = "Date"
+    orders_df.sort_index(ascending=True, inplace=True)
+    return orders_df
+
+
+def compute_portvals_from_prices(orders_df, df_prices, start_val=1000000, commission=9.95,
+    impact=0.005, holdings="auto"):
+    """
+    Compute the portfolio values of orders whose prices are already loaded
+
+    Parameters:
+    orders_df: A dataframe of orders as returned by read_orders
+    df_prices: A dataframe of prices as returned by get_prices
+    start_val: The starting value of the portfolio (initial cash available)
+    commission: The fixed amount in dollars charged for each transaction (both entry and exit)
+    impact: The amount the price moves against the trader compared to the historical data at each transaction
+    holdings: "dense", "sparse" (see compute_portvals_sparse) or "auto" to pick one with choose_holdings
+
+    Returns:
+    portvals: A dataframe with one column containing the value of the portfolio for each trading day
+    """
+
+    if holdings == "auto":
+        holdings = choose_holdings(orders_df, df_prices)
+    if holdings == "sparse":
+        return compute_portvals_sparse(orders_df, df_prices, start_val, commission, impact)
 
     # Create a dataframe that represents changes in the number of shares by day for each asset. 
-    # It has the same structure as df_prices, and is initially filled with zeros
-    df_trades = pd.DataFrame(np.zeros((df_prices.shape)), df_prices.index, df_prices.columns)
-    for index, row in orders_df.iterrows():
-        # Total value of shares purchased or sold
-        traded_share_value = df_prices.loc[index, row["Symbol"]] * row["Shares"]
-        # Transaction cost 
-        transaction_cost = commission + impact * traded_share_value
-
-        # Update the number of shares and cash based on the type of transaction done
-        # Note: The same asset may be traded more than once on a particular day
-        if row["Order"] == "BUY":
-            df_trades.loc[index, row["Symbol"]] = df_trades.loc[index, row["Symbol"]] + row["Shares"]
-            df_trades.loc[index, "cash"] = df_trades.loc[index, "cash"] + traded_share_value * (-1.0) - transaction_cost
-        else:
-            df_trades.loc[index, row["Symbol"]] = df_trades.loc[index, row["Symbol"]] -row["Shares"]
-            df_trades.loc[index, "cash"] = df_trades.loc[index, "cash"] + traded_share_value - transaction_cost
+    # It has the same structure as df_prices
+    df_trades = pd.DataFrame(compute_trades(orders_df, df_prices, commission, impact),
+        df_prices.index, df_prices.columns)
 
     # Create a dataframe that represents on each particular day how much of each asset in the portfolio
-    # It has the same structure as df_prices, and is initially filled with zeros
-    df_holdings = pd.DataFrame(np.zeros((df_prices.shape)), df_prices.index, df_prices.columns)
-    for row_count in range(len(df_holdings)):
-        # In the first row, the shares are the same as in df_trades, but start_val must be added to cash
-        if row_count == 0:
-            df_holdings.iloc[0, :-1] = df_trades.iloc[0, :-1].copy()
-            df_holdings.iloc[0, -1] = df_trades.iloc[0, -1] + start_val
-        # The rest of the rows show cumulative values
-        else:
-            df_holdings.iloc[row_count] = df_holdings.iloc[row_count-1] + df_trades.iloc[row_count]
-        row_count += 1
+    # It has the same structure as df_prices
+    df_holdings = pd.DataFrame(compute_holdings(df_trades.values, start_val),
+        df_prices.index, df_prices.columns)
 
     # Create a dataframe that represents the monetary value of each asset in the portfolio
     df_value = df_prices * df_holdings
@@ -81,6 +147,537 @@ def compute_portvals(orders_file = "./orders/orders.csv", start_val = 1000000, c
     return portvals
 
 
+def get_prices(symbols, start_date, end_date, df_all_prices=None):
+    """
+    Create a dataframe with adjusted close prices for the symbols and for cash on the 
+    trading days between start_date and end_date (inclusive). Missing prices are filled 
+    forward, then backward; the prices of cash are all 1.0
+
+    Parameters:
+    symbols: A list of traded symbols
+    start_date: First date to consider (inclusive)
+    end_date: Last date to consider (inclusive)
+    df_all_prices: Optional unfilled prices, as returned by get_data, covering the symbols 
+    and dates; prices are read with get_data if None
+
+    Returns:
+    df_prices: A dataframe with dates as indices and the symbols and "cash" as columns
+    """
+
+    if df_all_prices is None:
+        df_prices = get_data(symbols, pd.date_range(start_date, end_date), addSPY=True)
+        if "SPY" not in symbols:
+            del df_prices["SPY"]
+    else:
+        df_prices = df_all_prices.loc[start_date:end_date, symbols].copy()
+    df_prices["cash"] = 1.0
+
+    # Fill NAN values if any
+    df_prices = df_prices.ffill()
+    df_prices = df_prices.bfill()
+    df_prices = df_prices.fillna(1.0)
+    return df_prices
+
+
+def compute_trades(orders_df, df_prices, commission, impact):
+    """
+    Compute the changes in the number of shares and in cash caused by the orders on each day, 
+    without iterating over the orders. The same asset may be traded more than once on a 
+    particular day; such trades are accumulated in the order they appear in orders_df
+
+    Parameters:
+    orders_df: A dataframe of orders with dates as indices and Symbol, Order and Shares columns
+    df_prices: A dataframe of prices as returned by get_prices
+    commission: The fixed amount in dollars charged for each transaction
+    impact: The amount the price moves against the trader at each transaction
+
+    Returns:
+    trades: A numpy ndarray with the same shape as df_prices
+    """
+
+    rows, cols, share_deltas, cash_rows, cash_deltas = _order_deltas(orders_df, df_prices,
+        commission, impact)
+
+    # np.add.at accumulates repeated (date, symbol) pairs one order at a time
+    trades = np.zeros(df_prices.shape)
+    np.add.at(trades, (rows, cols), share_deltas)
+    np.add.at(trades, (cash_rows, df_prices.columns.get_loc("cash")), cash_deltas)
+    return trades
+
+
+def _order_deltas(orders_df, df_prices, commission, impact):
+    """
+    Compute the share and cash changes of each order. Cash changes twice per order, by the 
+    traded value and then by the transaction cost, so that adding them up in order 
+    reproduces the original ledger to the last bit
+
+    Returns:
+    rows, cols: The positions of the order dates and symbols in df_prices
+    share_deltas: The change in shares of each order
+    cash_rows, cash_deltas: The positions of the dates and the changes of cash
+    """
+
+    # Locate the date and symbol of each order in df_prices
+    rows = df_prices.index.get_indexer(orders_df.index)
+    cols = df_prices.columns.get_indexer(orders_df["Symbol"])
+    if (rows < 0).any():
+        raise KeyError("No prices for order dates: {}".format(orders_df.index[rows < 0].tolist()))
+    if (cols < 0).any():
+        raise KeyError("No prices for order symbols: {}".format(orders_df["Symbol"][cols < 0].tolist()))
+
+    # Total value of shares purchased or sold, and transaction cost
+    shares = orders_df["Shares"].values.astype(float)
+    traded_share_value = df_prices.values[rows, cols] * shares
+    transaction_cost = commission + impact * traded_share_value
+
+    # Buying adds shares and spends cash, selling does the opposite
+    is_buy = (orders_df["Order"] == "BUY").values
+    share_deltas = np.where(is_buy, shares, -shares)
+    cash_deltas = np.where(is_buy, traded_share_value * (-1.0), traded_share_value)
+
+    cash_rows = np.repeat(rows, 2)
+    cash_deltas = np.column_stack((cash_deltas, -transaction_cost)).ravel()
+    return rows, cols, share_deltas, cash_rows, cash_deltas
+
+
+def compute_holdings(trades, start_val):
+    """
+    Compute how much of each asset is in the portfolio on each day, as the cumulative sum 
+    of the trades, with start_val added to the cash of the first day
+
+    Parameters:
+    trades: A numpy ndarray as returned by compute_trades; its last column is cash
+    start_val: The starting value of the portfolio (initial cash available)
+
+    Returns:
+    holdings: A numpy ndarray with the same shape as trades
+    """
+
+    holdings = np.array(trades, dtype=float)
+    if len(holdings) > 0:
+        holdings[0, -1] = holdings[0, -1] + start_val
+    return np.cumsum(holdings, axis=0)
+
+
+def compute_portvals_sparse(orders_df, df_prices, start_val=1000000, commission=9.95,
+    impact=0.005):
+    """
+    Compute portfolio values from a sparse record of positions instead of dense trades and 
+    holdings dataframes. Each symbol's shares only change on its order dates, so its 
+    holdings are a few runs of constant shares; only the runs with open positions are 
+    valued. Time and memory grow with the number of open position-days rather than with 
+    days times symbols, and the result equals compute_portvals_from_prices exactly
+
+    Parameters:
+    orders_df: A dataframe of orders as returned by read_orders
+    df_prices: A dataframe of prices as returned by get_prices
+    start_val: The starting value of the portfolio (initial cash available)
+    commission: The fixed amount in dollars charged for each transaction (both entry and exit)
+    impact: The amount the price moves against the trader compared to the historical data at each transaction
+
+    Returns:
+    portvals: A dataframe with one column containing the value of the portfolio for each trading day
+    """
+
+    rows, cols, share_deltas, cash_rows, cash_deltas = _order_deltas(orders_df, df_prices,
+        commission, impact)
+    prices = df_prices.values
+    num_days = len(df_prices)
+
+    # Cash is a single column, kept dense
+    cash = np.zeros(num_days)
+    np.add.at(cash, cash_rows, cash_deltas)
+    cash = compute_holdings(cash[:, None], start_val)[:, 0]
+
+    # Value each symbol's runs of constant shares, symbols in column order
+    port_val = np.zeros(num_days)
+    order = np.argsort(cols, kind="mergesort")
+    rows, cols, share_deltas = rows[order], cols[order], share_deltas[order]
+    for col, positions in zip(*_split_groups(cols)):
+        trade_rows, inverse = np.unique(rows[positions], return_inverse=True)
+        day_trades = np.zeros(len(trade_rows))
+        np.add.at(day_trades, inverse, share_deltas[positions])
+        shares = np.cumsum(day_trades)
+        run_ends = np.append(trade_rows[1:], num_days)
+        for start, end, run_shares in zip(trade_rows, run_ends, shares):
+            if run_shares != 0:
+                port_val[start:end] += prices[start:end, col] * run_shares
+    port_val += cash
+
+    return pd.DataFrame(port_val, df_prices.index, ["port_val"])
+
+
+def _split_groups(sorted_values):
+    """Return the distinct values of a sorted array and the slice of positions of each"""
+    starts = np.flatnonzero(np.r_[True, sorted_values[1:] != sorted_values[:-1]])
+    ends = np.append(starts[1:], len(sorted_values))
+    return sorted_values[starts], [slice(start, end) for start, end in zip(starts, ends)]
+
+
+def choose_holdings(orders_df, df_prices):
+    """
+    Choose between dense and sparse holdings from the order statistics. Dense holdings 
+    cost a few operations per day and symbol; sparse holdings cost a Python step per run 
+    of constant shares, i.e. per distinct (symbol, order date) pair
+
+    Parameters:
+    orders_df: A dataframe of orders as returned by read_orders
+    df_prices: A dataframe of prices as returned by get_prices
+
+    Returns:
+    holdings: "sparse" or "dense"
+    """
+
+    num_runs = len(orders_df.groupby([orders_df.index, orders_df["Symbol"]]))
+    if num_runs * SPARSE_RUN_COST < df_prices.shape[0] * df_prices.shape[1]:
+        return "sparse"
+    return "dense"
+
+
+def compute_portvals_batch(order_sets, start_val=1000000, commission=9.95, impact=0.005,
+    names=None, daily_rf=0.0, samples_per_year=252.0, workers=1, executor="thread"):
+    """
+    Simulate many order sets against one shared price panel. Prices for the union of 
+    their symbols and dates are read once; each order set is then valued exactly as 
+    compute_portvals would
+
+    Parameters:
+    order_sets: A list of order sets, each accepted by read_orders (file name, file object, 
+    dataframe or array-like)
+    start_val: The starting value of each portfolio (initial cash available)
+    commission: The fixed amount in dollars charged for each transaction (both entry and exit)
+    impact: The amount the price moves against the trader compared to the historical data at each transaction
+    names: Optional names of the order sets; by default file names, paths for files with 
+    the same name, or "strategy_<i>"
+    daily_rf: Daily risk-free rate, assuming it does not change
+    samples_per_year: Sampling frequency per year
+    workers, executor: See map_tasks; each order set is one task
+
+    Returns:
+    portvals: A dataframe with one column of portfolio values per order set; dates outside 
+    an order set's range are NAN's
+    stats: A dataframe with one row per order set and columns cum_ret, avg_daily_ret, 
+    std_daily_ret and sharpe_ratio, computed with get_portfolio_stats
+    """
+
+    orders_dfs = [read_orders(orders) for orders in order_sets]
+    if names is None:
+        names = _order_set_names(order_sets)
+
+    # Read the prices of all symbols over all dates once
+    symbols = pd.unique(np.concatenate([df.Symbol.values for df in orders_dfs])).tolist()
+    start_date = min(df.index.min() for df in orders_dfs)
+    end_date = max(df.index.max() for df in orders_dfs)
+    df_all_prices = get_data(symbols, pd.date_range(start_date, end_date), addSPY=True)
+
+    # Each order set only sees the prices of its own symbols and dates
+    tasks = []
+    for orders_df in orders_dfs:
+        df_prices = get_prices(orders_df.Symbol.unique().tolist(), orders_df.index.min(),
+            orders_df.index.max(), df_all_prices)
+        tasks.append((orders_df, df_prices, start_val, commission, impact))
+
+    results = map_tasks(_run_order_set, tasks, workers, executor)
+
+    portvals = pd.concat([result.iloc[:, 0].rename(name) for name, result in zip(names, results)],
+        axis=1, sort=True)
+    stats = pd.DataFrame([get_portfolio_stats(result, daily_rf, samples_per_year) for result in results],
+        index=names, columns=["cum_ret", "avg_daily_ret", "std_daily_ret", "sharpe_ratio"])
+    return portvals, stats
+
+
+def _order_set_names(order_sets):
+    """
+    Name each order set after its file name, or "strategy_<i>" if it is not a file name. 
+    Files with the same name in different directories are named by their paths, and an 
+    order set given more than once gets its position appended
+    """
+    names = [os.path.basename(orders) if isinstance(orders, str) else "strategy_{}".format(i)
+        for i, orders in enumerate(order_sets)]
+    counts = collections.Counter(names)
+    names = [os.path.normpath(orders) if counts[name] > 1 and isinstance(orders, str) else name
+        for name, orders in zip(names, order_sets)]
+    counts = collections.Counter(names)
+    return [name if counts[name] == 1 else "{}_{}".format(name, i)
+        for i, name in enumerate(names)]
+
+
+def _run_order_set(task):
+    """Run compute_portvals_from_prices on a tuple of its arguments"""
+    return compute_portvals_from_prices(*task)
+
+
+class StreamingSimulator(object):
+    """
+    A market simulator that keeps the current holdings and cash, and is fed one trading 
+    day at a time. Each step costs O(number of symbols held), however long the history.
+
+    Feeding it the rows of get_prices and the orders of read_orders day by day, in their 
+    order, reproduces compute_portvals exactly.
+    """
+
+    def __init__(self, start_val=1000000, commission=9.95, impact=0.005):
+        self.commission = commission
+        self.impact = impact
+        self.cash = float(start_val)
+        self.symbols = []
+        self.symbol_index = {}
+        self.shares = np.zeros(0)
+        self.prices = np.zeros(0)
+        self.date = None
+
+    def step(self, date, prices, orders=()):
+        """
+        Advance the simulator by one trading day
+
+        Parameters:
+        date: The trading day, which must be after the previous step's
+        prices: A dictionary or series of the day's adjusted close prices by symbol; symbols 
+        without a price (or with NAN) keep their last known price
+        orders: The day's orders, either a dataframe with Symbol, Order and Shares columns or 
+        an iterable of (symbol, order, shares) tuples, executed in that order
+
+        Returns:
+        port_val: The value of the portfolio at the end of the day
+        """
+
+        if self.date is not None and pd.Timestamp(date) <= self.date:
+            raise ValueError("Dates must increase: {} after {}".format(date, self.date))
+        self.date = pd.Timestamp(date)
+
+        if isinstance(orders, pd.DataFrame):
+            orders = orders[["Symbol", "Order", "Shares"]].values
+        orders = list(orders)
+        for symbol, _, _ in orders:
+            self._add_symbol(symbol)
+
+        # Update the last known prices
+        for symbol, price in prices.items():
+            if symbol in self.symbol_index and not pd.isnull(price):
+                self.prices[self.symbol_index[symbol]] = price
+
+        # Accumulate the day's trades before adding them to the holdings, as compute_portvals does
+        share_trades = np.zeros(len(self.symbols))
+        cash_trade = 0.0
+        for symbol, order, shares in orders:
+            i = self.symbol_index[symbol]
+            if np.isnan(self.prices[i]):
+                raise ValueError("No price for {} on {}".format(symbol, date))
+            shares = float(shares)
+            traded_share_value = self.prices[i] * shares
+            transaction_cost = self.commission + self.impact * traded_share_value
+            if order == "BUY":
+                share_trades[i] = share_trades[i] + shares
+                cash_trade = cash_trade + traded_share_value * (-1.0)
+            else:
+                share_trades[i] = share_trades[i] - shares
+                cash_trade = cash_trade + traded_share_value
+            cash_trade = cash_trade - transaction_cost
+        self.shares = self.shares + share_trades
+        self.cash = self.cash + cash_trade
+
+        return self.value()
+
+    def value(self):
+        """Return the value of the portfolio at the last known prices"""
+        held = self.shares != 0
+        position_values = np.append(self.prices[held] * self.shares[held], self.cash)
+        # Sum from left to right, the order in which compute_portvals adds up the columns
+        return np.cumsum(position_values)[-1]
+
+    def snapshot(self):
+        """Return the state of the simulator as a dictionary of plain values, e.g. to checkpoint it"""
+        return {"commission": self.commission, "impact": self.impact, "cash": self.cash,
+            "symbols": list(self.symbols), "shares": self.shares.tolist(),
+            "prices": self.prices.tolist(), "date": self.date}
+
+    @classmethod
+    def restore(cls, snapshot):
+        """Create a simulator from a dictionary returned by snapshot"""
+        simulator = cls(snapshot["cash"], snapshot["commission"], snapshot["impact"])
+        for symbol in snapshot["symbols"]:
+            simulator._add_symbol(symbol)
+        simulator.shares = np.array(snapshot["shares"], dtype=float)
+        simulator.prices = np.array(snapshot["prices"], dtype=float)
+        simulator.date = snapshot["date"]
+        return simulator
+
+    def _add_symbol(self, symbol):
+        if symbol not in self.symbol_index:
+            self.symbol_index[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+            self.shares = np.append(self.shares, 0.0)
+            self.prices = np.append(self.prices, np.nan)
+
+
+def compute_portvals_streaming(orders_df, df_prices, start_val=1000000, commission=9.95,
+    impact=0.005):
+    """
+    Compute portfolio values by feeding a StreamingSimulator one day at a time
+
+    Parameters:
+    orders_df: A dataframe of orders as returned by read_orders
+    df_prices: A dataframe of prices as returned by get_prices
+    start_val: The starting value of the portfolio (initial cash available)
+    commission: The fixed amount in dollars charged for each transaction (both entry and exit)
+    impact: The amount the price moves against the trader compared to the historical data at each transaction
+
+    Returns:
+    portvals: A dataframe with one column containing the value of the portfolio for each trading day
+    """
+
+    simulator = StreamingSimulator(start_val, commission, impact)
+    orders_by_date = dict(list(orders_df.groupby(level=0, sort=False)))
+    values = []
+    for date, prices in df_prices.iterrows():
+        values.append(simulator.step(date, prices, orders_by_date.get(date, ())))
+    return pd.DataFrame(values, df_prices.index, ["port_val"])
+
+
+def compute_portvals_chunked(orders_file, start_val=1000000, commission=9.95, impact=0.005,
+    chunksize=100000, block_days=365):
+    """
+    Compute portfolio values for an orders file too large to hold in memory. Orders are 
+    read in chunks of rows; if the file is not sorted by date, the sorted chunks are 
+    written to temporary files and merged. Prices are read in blocks of calendar days and 
+    the holdings are kept by a StreamingSimulator, so no dataframe spans all orders or all 
+    days times all symbols; memory grows with the number of symbols.
+
+    Results equal compute_portvals, up to the order in which trades of the same day add 
+    up, except when a symbol has no price at all in a block before its first price: that 
+    gap is filled with 1.0 instead of its first later price.
+
+    Parameters:
+    orders_file: The name of a file from which to read orders, or a seekable file object
+    start_val: The starting value of the portfolio (initial cash available)
+    commission: The fixed amount in dollars charged for each transaction (both entry and exit)
+    impact: The amount the price moves against the trader compared to the historical data at each transaction
+    chunksize: Number of orders read at a time
+    block_days: Number of calendar days of prices read at a time
+
+    Returns:
+    portvals: A dataframe with one column containing the value of the portfolio for each trading day
+    """
+
+    # First pass: the symbols and date range of the orders, and whether they are sorted
+    symbols = []
+    start_date, end_date = None, None
+    is_sorted = True
+    for orders_df in _read_order_chunks(orders_file, chunksize):
+        symbols.extend(symbol for symbol in orders_df.Symbol.unique() if symbol not in symbols)
+        if end_date is not None and orders_df.index.min() < end_date:
+            is_sorted = False
+        is_sorted = is_sorted and orders_df.index.is_monotonic_increasing
+        start_date = orders_df.index.min() if start_date is None else min(start_date, orders_df.index.min())
+        end_date = orders_df.index.max() if end_date is None else max(end_date, orders_df.index.max())
+
+    run_dir = None if is_sorted else tempfile.mkdtemp()
+    try:
+        if is_sorted:
+            order_chunks = _read_order_chunks(orders_file, chunksize)
+        else:
+            order_chunks = _merge_order_runs(_write_order_runs(orders_file, chunksize, run_dir),
+                chunksize)
+        return _simulate_order_chunks(order_chunks, symbols, start_date, end_date,
+            start_val, commission, impact, block_days)
+    finally:
+        if run_dir is not None:
+            shutil.rmtree(run_dir)
+
+
+def _simulate_order_chunks(order_chunks, symbols, start_date, end_date, start_val, commission,
+    impact, block_days):
+    """Feed chunks of orders sorted by date and blocks of prices to a StreamingSimulator"""
+    simulator = StreamingSimulator(start_val, commission, impact)
+    order_days = _iter_order_days(order_chunks)
+    order_date, day_orders = next(order_days, (None, None))
+    last_prices = None
+    dates = []
+    values = []
+    for block_start in pd.date_range(start_date, end_date, freq="{}D".format(block_days)):
+        block_end = min(block_start + pd.Timedelta(days=block_days - 1), end_date)
+        df_prices = get_data(symbols, pd.date_range(block_start, block_end), addSPY=True)
+        if "SPY" not in symbols:
+            del df_prices["SPY"]
+
+        # Carry the last prices of the previous block forward, then fill as get_prices does
+        if last_prices is not None:
+            df_prices = pd.concat([last_prices, df_prices]).ffill().iloc[1:]
+        df_prices = df_prices.ffill().bfill().fillna(1.0)
+        if len(df_prices) > 0:
+            last_prices = df_prices.iloc[[-1]]
+
+        for date, prices in zip(df_prices.index, df_prices.values):
+            if order_date is not None and order_date < date:
+                raise KeyError("No prices for order date: {}".format(order_date))
+            orders = ()
+            if order_date == date:
+                orders = day_orders
+                order_date, day_orders = next(order_days, (None, None))
+            dates.append(date)
+            values.append(simulator.step(date, dict(zip(symbols, prices)), orders))
+
+    if order_date is not None:
+        raise KeyError("No prices for order date: {}".format(order_date))
+    return pd.DataFrame(values, pd.DatetimeIndex(dates), ["port_val"])
+
+
+def _read_order_chunks(orders_file, chunksize):
+    """Read an orders file in chunks of rows"""
+    if hasattr(orders_file, "seek"):
+        orders_file.seek(0)
+    return pd.read_csv(orders_file, index_col='Date', parse_dates=True, na_values=['nan'],
+        chunksize=chunksize)
+
+
+def _write_order_runs(orders_file, chunksize, run_dir):
+    """Sort each chunk of an orders file by date and write it to run_dir; return the file names"""
+    run_paths = []
+    for orders_df in _read_order_chunks(orders_file, chunksize):
+        run_paths.append(os.path.join(run_dir, "run_{}.csv".format(len(run_paths))))
+        orders_df.sort_index(kind="mergesort").to_csv(run_paths[-1])
+    return run_paths
+
+
+def _merge_order_runs(run_paths, chunksize):
+    """Merge orders files sorted by date into chunks of orders sorted by date"""
+    def read_rows(run_path):
+        for orders_df in _read_order_chunks(run_path, chunksize):
+            for row in orders_df.itertuples():
+                yield row
+
+    # heapq.merge keeps the file order of orders with the same date
+    rows = []
+    for row in heapq.merge(*[read_rows(run_path) for run_path in run_paths], key=lambda row: row[0]):
+        rows.append(row)
+        if len(rows) == chunksize:
+            yield _rows_to_orders(rows)
+            rows = []
+    if rows:
+        yield _rows_to_orders(rows)
+
+
+def _rows_to_orders(rows):
+    """Convert (Date, Symbol, Order, Shares) named tuples into a dataframe of orders"""
+    return pd.DataFrame([row[1:] for row in rows], columns=rows[0]._fields[1:],
+        index=pd.DatetimeIndex([row[0] for row in rows], name="Date"))
+
+
+def _iter_order_days(order_chunks):
+    """Yield (date, orders of that date) pairs from chunks of orders sorted by date"""
+    pending = None
+    for orders_df in order_chunks:
+        if pending is not None:
+            orders_df = pd.concat([pending, orders_df])
+        # The last date of a chunk may continue in the next chunk
+        last_date = orders_df.index[-1]
+        for date, day_orders in orders_df[orders_df.index < last_date].groupby(level=0):
+            yield date, day_orders
+        pending = orders_df[orders_df.index == last_date]
+    if pending is not None:
+        yield pending.index[0], pending
+
+
 def market_simulator(orders_file, start_val=1000000, daily_rf=0.0, samples_per_year=252.0, 
     save_fig=False, fig_name="plot.png"):
     """
@@ -131,6 +728,11 @@ def market_simulator(orders_file, start_val=1000000, daily_rf=0.0, samples_per_y
     print ("Average Daily Return of $SPX : {}".format(avg_daily_ret_SPX))
     print ()
     print ("Final Portfolio Value: {}".format(portvals.iloc[-1, -1]))
+    print ()
+    max_drawdowns = get_max_drawdowns(portvals).iloc[0]
+    print ("Maximum Drawdown of Fund: {} on {}".format(max_drawdowns["max_drawdown"],
+        max_drawdowns["max_drawdown_date"]))
+    print ("Longest Drawdown of Fund: {} trading days".format(int(max_drawdowns["max_duration"])))
 
     # Plot the data
     plot_normalized_data(SPX_prices.join(portvals), "Portfolio vs. SPX", "Date", "Normalized prices",
@@ -0,0 +1,165 @@
+"""Rolling risk analytics of portfolio values"""
+
+import pandas as pd
+import numpy as np
+import sys
+# Append the path of the directory one level above the current directory to import util
+sys.path.append('../')
+from util import *
+
+
+def get_rolling_stats(port_vals, windows=(21, 63, 252), daily_rf=0.0, samples_per_year=252.0):
+    """
+    Compute rolling statistics and drawdowns of many portfolios at once
+
+    Parameters:
+    port_vals: A dataframe of portfolio values with dates as indices and one column per
+    portfolio, e.g. returned by compute_portvals or compute_portvals_batch
+    windows: Numbers of daily returns in the rolling windows
+    daily_rf: Daily risk-free rate, assuming it does not change
+    samples_per_year: Sampling frequency per year
+
+    Returns:
+    df_stats: A dataframe with the same dates as port_vals and two column levels: the
+    statistic, i.e. volatility_<window> and sharpe_<window> for each window, drawdown and
+    drawdown_duration, and the portfolio. See get_rolling_volatility, get_rolling_sharpe
+    and get_drawdowns
+    """
+
+    stats = {}
+    for window in windows:
+        rolling_mean, rolling_std = _get_rolling_moments(port_vals.values, window)
+        stats["volatility_{}".format(window)] = rolling_std
+        with np.errstate(invalid="ignore", divide="ignore"):
+            stats["sharpe_{}".format(window)] = compute_sharpe_ratio(np.sqrt(samples_per_year),
+                rolling_mean, daily_rf, rolling_std)
+    stats["drawdown"], stats["drawdown_duration"] = _get_drawdowns(port_vals.values)
+
+    return pd.concat({name: pd.DataFrame(values, port_vals.index, port_vals.columns)
+        for name, values in stats.items()}, axis=1)
+
+
+def get_rolling_volatility(port_vals, window=21):
+    """
+    Compute the rolling standard deviation of daily return of each portfolio
+
+    Parameters:
+    port_vals: A dataframe of portfolio values with one column per portfolio
+    window: Number of daily returns in the rolling window
+
+    Returns:
+    df_volatility: A dataframe with the same structure as port_vals; NAN's until the
+    window is full and while it holds a NAN return
+    """
+
+    rolling_std = _get_rolling_moments(port_vals.values, window)[1]
+    return pd.DataFrame(rolling_std, port_vals.index, port_vals.columns)
+
+
+def get_rolling_sharpe(port_vals, window=21, daily_rf=0.0, samples_per_year=252.0):
+    """
+    Compute the rolling Sharpe ratio of each portfolio
+
+    Parameters:
+    port_vals: A dataframe of portfolio values with one column per portfolio
+    window: Number of daily returns in the rolling window
+    daily_rf: Daily risk-free rate, assuming it does not change
+    samples_per_year: Sampling frequency per year
+
+    Returns:
+    df_sharpe: A dataframe with the same structure as port_vals
+    """
+
+    rolling_mean, rolling_std = _get_rolling_moments(port_vals.values, window)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        sharpe = compute_sharpe_ratio(np.sqrt(samples_per_year), rolling_mean, daily_rf,
+            rolling_std)
+    return pd.DataFrame(sharpe, port_vals.index, port_vals.columns)
+
+
+def get_drawdowns(port_vals):
+    """
+    Compute the drawdown of each portfolio from its running peak, and how long it has lasted
+
+    Parameters:
+    port_vals: A dataframe of portfolio values with one column per portfolio
+
+    Returns:
+    df_drawdown: A dataframe with the same structure as port_vals of the fraction lost
+    since the running peak (0 at a peak, negative below it)
+    df_duration: A dataframe of the number of trading days since the running peak
+    """
+
+    drawdown, duration = _get_drawdowns(port_vals.values)
+    return pd.DataFrame(drawdown, port_vals.index, port_vals.columns), \
+        pd.DataFrame(duration, port_vals.index, port_vals.columns)
+
+
+def get_max_drawdowns(port_vals):
+    """
+    Summarize the drawdowns of each portfolio
+
+    Parameters:
+    port_vals: A dataframe of portfolio values with one column per portfolio
+
+    Returns:
+    df_max_drawdowns: A dataframe with one row per portfolio and columns max_drawdown
+    (the largest fraction lost from a peak, as a negative number), max_drawdown_date
+    (when it was reached) and max_duration (the longest number of trading days spent
+    below a peak)
+    """
+
+    drawdown, duration = _get_drawdowns(port_vals.values)
+    with np.errstate(invalid="ignore"):
+        return pd.DataFrame({"max_drawdown": np.nanmin(drawdown, axis=0),
+            "max_drawdown_date": port_vals.index[np.argmin(np.nan_to_num(drawdown), axis=0)],
+            "max_duration": np.nanmax(duration, axis=0)}, index=port_vals.columns)
+
+
+def _get_rolling_moments(values, window):
+    """
+    Compute the rolling mean and (sample) standard deviation of the daily returns of each
+    column of values, like pandas' rolling(window) on the returns. Window sums come from
+    cumulative sums of the returns, centered on their column means to keep the sums small,
+    so each window costs O(1) per portfolio and no window is copied
+    """
+
+    daily_returns = np.full(values.shape, np.nan)
+    daily_returns[1:] = values[1:] / values[:-1] - 1
+    is_nan = np.isnan(daily_returns)
+    counts = np.maximum((~is_nan).sum(axis=0), 1)
+    column_means = np.where(is_nan, 0.0, daily_returns).sum(axis=0) / counts
+    centered = np.where(is_nan, 0.0, daily_returns - column_means)
+
+    zeros = np.zeros((1, values.shape[1]))
+    sums = np.concatenate((zeros, np.cumsum(centered, axis=0)))
+    squares = np.concatenate((zeros, np.cumsum(centered ** 2, axis=0)))
+    nans = np.concatenate((zeros, np.cumsum(is_nan, axis=0)))
+
+    rolling_mean = np.full(values.shape, np.nan)
+    rolling_std = np.full(values.shape, np.nan)
+    if window > len(values):
+        return rolling_mean, rolling_std
+    window_sum = sums[window:] - sums[:-window]
+    window_squares = squares[window:] - squares[:-window]
+    full = (nans[window:] - nans[:-window]) == 0
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = window_sum / window
+        variance = np.maximum(window_squares - window_sum * mean, 0.0) / (window - 1)
+    rolling_mean[window - 1:] = np.where(full, mean + column_means, np.nan)
+    rolling_std[window - 1:] = np.where(full, np.sqrt(variance), np.nan)
+    return rolling_mean, rolling_std
+
+
+def _get_drawdowns(values):
+    """Compute the drawdowns and their durations of each column of values in one pass"""
+    positions = np.arange(len(values))[:, None]
+    running_peak = np.fmax.accumulate(values, axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        drawdown = values / running_peak - 1
+        # Position of the latest running peak
+        peak_positions = np.maximum.accumulate(np.where(values >= running_peak, positions, 0),
+            axis=0)
+    duration = np.where(np.isnan(values), np.nan, positions - peak_positions)
+    return drawdown, duration
@@ -1,11 +1,27 @@
 """Test for optimization.py"""
 
 
-from marketsim import compute_portvals
+from marketsim import compute_portvals, compute_trades, compute_holdings, \
+    compute_portvals_from_prices, StreamingSimulator, compute_portvals_sparse, \
+    compute_portvals_from_data, read_orders, compute_portvals_chunked, get_prices, \
+    compute_portvals_batch
 import unittest
 import math
+import io
+import os
+import shutil
+import tempfile
+import datetime as dt
+import numpy as np
 import pandas as pd
-from analysis import get_portfolio_stats
+import sys
+# Append the path of the directory one level above the current directory to import util
+sys.path.append('../')
+from util import get_data
+from analysis import get_portfolio_stats, get_portfolio_value, assess_allocations, \
+    assess_portfolio, optimize_portfolio, sample_efficient_frontier
+from rolling_analysis import get_rolling_volatility, get_rolling_sharpe, get_drawdowns, \
+    get_max_drawdowns, get_rolling_stats
 
 
 class TestMarketSimWithOrders(unittest.TestCase):
@@ -44,5 +60,235 @@ class TestMarketSimWithOrders2(unittest.TestCase):
         self.assertTrue(math.isclose(portvals.iloc[-1, -1], 1051088.0915, rel_tol=0.02), "Portfolio value is incorrect")    
     
 
+class TestComputeTrades(unittest.TestCase):
+
+    def test_same_day_trades(self):
+        dates = pd.date_range("2011-01-03", periods=3)
+        df_prices = pd.DataFrame({"AAPL": [10.0, 11.0, 12.0], "IBM": [20.0, 21.0, 22.0],
+            "cash": 1.0}, index=dates)
+        orders_df = pd.DataFrame({"Symbol": ["AAPL", "AAPL", "IBM", "AAPL"],
+            "Order": ["BUY", "BUY", "SELL", "SELL"], "Shares": [100, 50, 10, 150]},
+            index=[dates[0], dates[0], dates[1], dates[2]])
+
+        trades = compute_trades(orders_df, df_prices, commission=9.95, impact=0.005)
+        expected_trades = np.array([
+            [150.0, 0.0, -1000.0 - (9.95 + 5.0) - 500.0 - (9.95 + 2.5)],
+            [0.0, -10.0, 210.0 - (9.95 + 1.05)],
+            [-150.0, 0.0, 1800.0 - (9.95 + 9.0)]])
+        np.testing.assert_allclose(trades, expected_trades)
+
+        holdings = compute_holdings(trades, start_val=10000)
+        np.testing.assert_allclose(holdings[-1], [0.0, -10.0, 10000 + expected_trades[:, 2].sum()])
+
+    def test_missing_order_date(self):
+        dates = pd.date_range("2011-01-03", periods=2)
+        df_prices = pd.DataFrame({"AAPL": [10.0, 11.0], "cash": 1.0}, index=dates)
+        orders_df = pd.DataFrame({"Symbol": ["AAPL"], "Order": ["BUY"], "Shares": [1]},
+            index=[pd.Timestamp("2011-01-10")])
+        with self.assertRaises(KeyError):
+            compute_trades(orders_df, df_prices, commission=0.0, impact=0.0)
+
+
+class TestStreamingSimulator(unittest.TestCase):
+
+    def setUp(self):
+        dates = pd.date_range("2011-01-03", periods=5)
+        self.df_prices = pd.DataFrame({"AAPL": [10.0, 11.0, 12.5, 12.0, 13.1],
+            "IBM": [20.0, 21.3, 19.7, 22.0, 22.4], "cash": 1.0}, index=dates)
+        self.orders_df = pd.DataFrame({"Symbol": ["AAPL", "IBM", "AAPL", "IBM", "AAPL"],
+            "Order": ["BUY", "BUY", "BUY", "SELL", "SELL"], "Shares": [100, 30, 50, 30, 150]},
+            index=[dates[0], dates[1], dates[1], dates[3], dates[4]])
+
+    def test_matches_compute_portvals(self):
+        portvals = compute_portvals_from_prices(self.orders_df, self.df_prices)
+
+        simulator = StreamingSimulator()
+        for date, prices in self.df_prices.iterrows():
+            if date == self.df_prices.index[2]:
+                simulator = StreamingSimulator.restore(simulator.snapshot())
+            orders = self.orders_df[self.orders_df.index == date]
+            self.assertEqual(simulator.step(date, prices, orders), portvals.loc[date, "port_val"])
+
+    def test_dates_must_increase(self):
+        simulator = StreamingSimulator()
+        simulator.step(self.df_prices.index[1], {"AAPL": 10.0})
+        with self.assertRaises(ValueError):
+            simulator.step(self.df_prices.index[0], {"AAPL": 10.0})
+
+
+class TestSparseHoldings(unittest.TestCase):
+
+    def test_matches_dense_holdings(self):
+        dates = pd.date_range("2011-01-03", periods=6)
+        df_prices = pd.DataFrame({"AAPL": [10.0, 11.0, 12.5, 12.0, 13.1, 13.3],
+            "GOOG": [30.0, 31.2, 29.9, 30.4, 32.0, 31.5],
+            "IBM": [20.0, 21.3, 19.7, 22.0, 22.4, 21.9], "cash": 1.0}, index=dates)
+        orders_df = pd.DataFrame({"Symbol": ["IBM", "AAPL", "IBM", "IBM", "AAPL"],
+            "Order": ["BUY", "SELL", "BUY", "SELL", "BUY"], "Shares": [30, 100, 20, 50, 100]},
+            index=[dates[0], dates[1], dates[1], dates[3], dates[4]])
+
+        dense = compute_portvals_from_prices(orders_df, df_prices, holdings="dense")
+        sparse = compute_portvals_sparse(orders_df, df_prices)
+        np.testing.assert_array_equal(dense.values, sparse.values)
+        self.assertTrue(dense.index.equals(sparse.index))
+
+
+class TestChunkedPortvals(unittest.TestCase):
+
+    def test_unsorted_orders(self):
+        # Shuffle the orders so that the chunks are sorted, written to temporary files and merged
+        with open("./orders/orders.csv") as f:
+            header, lines = f.readline(), f.readlines()
+        lines = [lines[i] for i in np.random.default_rng(0).permutation(len(lines))]
+        orders_text = header + "".join(lines)
+
+        portvals = compute_portvals_chunked(io.StringIO(orders_text), chunksize=3, block_days=30)
+        orders_df = read_orders(io.StringIO(orders_text))
+        df_prices = get_prices(orders_df.Symbol.unique().tolist(), orders_df.index.min(),
+            orders_df.index.max())
+        expected = compute_portvals_from_prices(orders_df, df_prices)
+        self.assertTrue(portvals.index.equals(expected.index))
+        np.testing.assert_array_equal(portvals.values, expected.values)
+
+
+class TestPortvalsBatch(unittest.TestCase):
+
+    def test_matches_compute_portvals(self):
+        # Two files named orders.csv in different directories need different names
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        other_orders = os.path.join(temp_dir, "orders.csv")
+        shutil.copy("./orders/orders-04.csv", other_orders)
+        order_sets = ["./orders/orders.csv", "./orders/orders2.csv", other_orders,
+            read_orders("./orders/orders-short.csv")]
+
+        portvals, stats = compute_portvals_batch(order_sets, workers=2)
+        names = [os.path.normpath("./orders/orders.csv"), "orders2.csv",
+            os.path.normpath(other_orders), "strategy_3"]
+        self.assertEqual(portvals.columns.tolist(), names)
+        self.assertEqual(stats.index.tolist(), names)
+        for name, orders in zip(names, order_sets):
+            expected = compute_portvals(orders)
+            column = portvals[name].dropna()
+            self.assertTrue(column.index.equals(expected.index))
+            np.testing.assert_array_equal(column.values, expected.iloc[:, 0].values)
+            self.assertEqual(tuple(stats.loc[name]), get_portfolio_stats(expected, 0.0, 252.0))
+
+    def test_same_file_twice(self):
+        portvals, _ = compute_portvals_batch(["./orders/orders2.csv", "./orders/orders2.csv"])
+        self.assertEqual(portvals.columns.tolist(), [os.path.normpath("./orders/orders2.csv") + "_0",
+            os.path.normpath("./orders/orders2.csv") + "_1"])
+
+
+class TestPortvalsFromData(unittest.TestCase):
+
+    def test_uses_loaded_prices(self):
+        dates = pd.date_range("2011-01-03", periods=5)
+        df_close = pd.DataFrame({"AAPL": [10.0, 11.0, np.nan, 12.0, 13.1],
+            "IBM": [20.0, 21.3, 19.7, 22.0, 22.4], "SPY": 100.0}, index=dates)
+        orders = [[dates[1], "AAPL", "BUY", 100], [dates[3], "AAPL", "SELL", 100],
+            [dates[1], "IBM", "SELL", 50], [dates[4], "IBM", "BUY", 50]]
+
+        portvals = compute_portvals_from_data(orders, {"Adj Close": df_close})
+        df_prices = df_close.loc[dates[1]:, ["AAPL", "IBM"]].ffill()
+        df_prices["cash"] = 1.0
+        expected = compute_portvals_from_prices(read_orders(orders), df_prices)
+        np.testing.assert_array_equal(portvals.values, expected.values)
+        self.assertTrue(portvals.index.equals(dates[1:]))
+
+
+class TestAssessAllocations(unittest.TestCase):
+
+    def test_matches_single_allocations(self):
+        prices = pd.DataFrame({"AAPL": [10.0, 11.0, 12.5, 12.0, 13.1, 13.3],
+            "GOOG": [30.0, 31.2, 29.9, 30.4, 32.0, 31.5],
+            "IBM": [20.0, 21.3, 19.7, 22.0, 22.4, 21.9]}, index=pd.date_range("2011-01-03", periods=6))
+        allocs = np.array([[0.2, 0.3, 0.5], [1.0, 0.0, 0.0], [0.6, 0.1, 0.3]])
+
+        stats = assess_allocations(prices, allocs, sv=1000000, rfr=0.0001, sf=252.0, batch_size=2)
+        for i, alloc in enumerate(allocs):
+            port_val = get_portfolio_value(prices, alloc, 1000000)
+            expected = get_portfolio_stats(port_val, 0.0001, 252.0) + (port_val.iloc[-1, 0],)
+            np.testing.assert_allclose([stat[i] for stat in stats], expected, rtol=1e-12)
+
+
+class TestOptimizePortfolio(unittest.TestCase):
+
+    def setUp(self):
+        self.sd = dt.datetime(2011, 1, 1)
+        self.ed = dt.datetime(2011, 6, 30)
+        self.syms = ["AAPL", "GOOG", "IBM", "XOM", "GLD"]
+        self.prices = get_data(self.syms, pd.date_range(self.sd, self.ed))[self.syms]
+        self.df_frontier = sample_efficient_frontier(self.prices, 2000, rfr=0.0001)
+
+    def test_max_sharpe(self):
+        allocs, cr, adr, sddr, sr = optimize_portfolio(self.prices, rfr=0.0001)
+        self.assertAlmostEqual(allocs.sum(), 1.0, places=12)
+        self.assertTrue(np.all(allocs >= 0.0))
+
+        # The buy-and-hold Sharpe ratio beats equal weights and every sampled portfolio, 
+        equal_sr = assess_allocations(self.prices, [[0.2] * 5], rfr=0.0001)[3][0]
+        self.assertGreater(sr, equal_sr)
+        # up to rounding, as the sampled portfolios include the single-symbol ones
+        self.assertGreaterEqual(sr, self.df_frontier["sr"].max() - 1e-12)
+        self.assertEqual((cr, adr, sddr, sr), assess_portfolio(self.sd, self.ed, self.syms,
+            allocs, rfr=0.0001)[:4])
+
+    def test_min_volatility(self):
+        allocs, cr, adr, sddr, sr = optimize_portfolio(self.prices, "volatility",
+            bounds=(0.05, 0.6))
+        self.assertAlmostEqual(allocs.sum(), 1.0, places=12)
+        self.assertTrue(np.all((allocs >= 0.05) & (allocs <= 0.6)))
+        in_bounds = ((self.df_frontier[self.syms] >= 0.05) & (self.df_frontier[self.syms] <= 0.6)).all(axis=1)
+        self.assertLessEqual(sddr, self.df_frontier["sddr"][in_bounds].min())
+        self.assertEqual((cr, adr, sddr, sr), assess_portfolio(self.sd, self.ed, self.syms,
+            allocs)[:4])
+
+
+class TestRollingAnalysis(unittest.TestCase):
+
+    def setUp(self):
+        # Portfolio values with NAN's outside the range of some portfolios, as returned by 
+        # compute_portvals_batch
+        rng = np.random.default_rng(0)
+        values = 1000000 * np.cumprod(1 + rng.normal(0.0003, 0.01, (300, 3)), axis=0)
+        self.port_vals = pd.DataFrame(values, pd.date_range("2011-01-03", periods=300),
+            ["a", "b", "c"])
+        self.port_vals.iloc[:40, 1] = np.nan
+        self.port_vals.iloc[250:, 1] = np.nan
+        self.port_vals.iloc[:120, 2] = np.nan
+
+    def test_rolling_matches_pandas(self):
+        daily_returns = self.port_vals.pct_change(fill_method=None)
+        for window in [21, 63]:
+            rolling = daily_returns.rolling(window)
+            expected_sharpe = np.sqrt(252.0) * (rolling.mean() - 0.0001) / rolling.std()
+            pd.testing.assert_frame_equal(get_rolling_volatility(self.port_vals, window),
+                rolling.std(), rtol=1e-9, atol=1e-13)
+            pd.testing.assert_frame_equal(get_rolling_sharpe(self.port_vals, window, 0.0001),
+                expected_sharpe, rtol=1e-9)
+
+        df_stats = get_rolling_stats(self.port_vals, windows=(21,), daily_rf=0.0001)
+        pd.testing.assert_frame_equal(df_stats["sharpe_21"], get_rolling_sharpe(self.port_vals,
+            21, 0.0001))
+
+    def test_drawdowns_match_running_peak(self):
+        expected = self.port_vals / self.port_vals.cummax() - 1
+        df_drawdown, df_duration = get_drawdowns(self.port_vals)
+        pd.testing.assert_frame_equal(df_drawdown, expected)
+
+        # Trading days since the latest date at the running peak
+        for column in self.port_vals.columns:
+            at_peak = (expected[column] == 0).values
+            for i in np.flatnonzero(self.port_vals[column].notnull().values):
+                self.assertEqual(df_duration[column].iloc[i], i - np.flatnonzero(at_peak[:i + 1])[-1])
+        self.assertTrue(df_duration[self.port_vals.isnull()].isnull().all().all())
+
+        df_max_drawdowns = get_max_drawdowns(self.port_vals)
+        np.testing.assert_array_equal(df_max_drawdowns["max_drawdown"], expected.min())
+        np.testing.assert_array_equal(df_max_drawdowns["max_drawdown_date"], expected.idxmin())
+        np.testing.assert_array_equal(df_max_drawdowns["max_duration"], df_duration.max())
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -7,12 +7,15 @@ import pickle
 import datetime as dt
 import matplotlib.pyplot as plt
 import sys
+import concurrent.futures
+from multiprocessing import shared_memory
 # Append the path of the directory one level above the current directory to import util
 sys.path.append('../')
 from util import *
 
 
-def detect_return_diff(symbols, data_dict, symbol_change=-0.05, market_change=0.03):
+def detect_return_diff(symbols, data_dict, symbol_change=-0.05, market_change=0.03,
+                       market_sym="SPY"):
     """ 
     Create the event dataframe. Here we are only interested in the opposite movements of 
     symbol and market, i.e. symbol_change and market_change are of opposite signs
@@ -23,87 +26,187 @@ def detect_return_diff(symbols, data_dict, symbol_change=-0.05, market_change=0.
     values are dataframes with dates as indices and symbols as columns
     symbol_change: Min.(if positive) or max. (if negative) change in the return of symbol
     market_change: Max.(if negative) or min. (if positive) change in the return of market
+    market_sym: Symbol of the market index
     
     Returns:
     df_events: A dataframe filled with either 1's for detected events or NAN's for no events
     """
 
     df_close = data_dict["Adj Close"]
-    market_close = df_close["SPY"]
+    market_close = df_close[market_sym]
 
     # Create a dataframe filled with NAN's
-    df_events = copy.deepcopy(df_close)
-    df_events = df_events * np.NAN
-
-    # Dates for the event range
-    dates = df_close.index
-
-    for symbol in symbols:
-        for i in range(1, len(dates)):
-            # Calculate the returns for this date
-            symbol_return = (df_close[symbol].loc[dates[i]] / df_close[symbol].loc[dates[i - 1]]) - 1
-            market_return = (market_close.loc[dates[i]] / market_close.loc[dates[i - 1]]) - 1
-
-            # Event is found if both the symbol and market cross their respective thresholds
-            if symbol_change < 0 and market_change > 0:
-                if symbol_return <= symbol_change and market_return >= market_change:
-                    df_events[symbol].loc[dates[i]] = 1
-            elif symbol_change > 0 and market_change < 0:
-                if symbol_return >= symbol_change and market_return <= market_change:
-                    df_events[symbol].loc[dates[i]] = 1
-            else:
-                print ("Here we are only interested in the opposite movements of symbol and market, \
-                    i.e. you should ensure symbol_change and market_change are of opposite signs")
+    df_events = df_close * np.nan
+
+    if not (symbol_change < 0 and market_change > 0) and not (symbol_change > 0 and market_change < 0):
+        print ("Here we are only interested in the opposite movements of symbol and market, \
+            i.e. you should ensure symbol_change and market_change are of opposite signs")
+        return df_events
+
+    # Calculate the returns of all symbols and of the market for all dates at once; 
+    # the first date has no return
+    symbol_close = df_close[symbols].values
+    symbol_returns = np.full(symbol_close.shape, np.nan)
+    symbol_returns[1:] = (symbol_close[1:] / symbol_close[:-1]) - 1
+    market_returns = np.full(len(market_close), np.nan)
+    market_returns[1:] = (market_close.values[1:] / market_close.values[:-1]) - 1
+
+    # Event is found if both the symbol and market cross their respective thresholds
+    with np.errstate(invalid="ignore"):
+        if symbol_change < 0:
+            is_event = (symbol_returns <= symbol_change) & (market_returns >= market_change)[:, None]
+        else:
+            is_event = (symbol_returns >= symbol_change) & (market_returns <= market_change)[:, None]
+
+    df_events[symbols] = np.where(is_event, 1.0, np.nan)
     return df_events
 
 
-def output_events_as_trades(df_events_input, output_filename="df_trades.csv"):
+def detect_events_sharded(detector, symbols, data_dict, workers=2, num_shards=None,
+                          market_sym="SPY", **kwargs):
+    """ 
+    Run an event detector, e.g. detect_return_diff or detect_bollinger, on shards of the 
+    symbols in a process pool. The adjusted close prices are copied once into shared memory, 
+    from which each worker reads its shard and the market, so the price panel is not pickled
+
+    Parameters:
+    detector: A module-level event detector taking symbols, data_dict, market_sym and 
+    keyword arguments
+    symbols: A list of symbols of interest
+    data_dict: A dictionary whose keys are types of data, e.g. Adj Close, Volume, etc. and 
+    values are dataframes with dates as indices and symbols as columns
+    workers: Number of worker processes; the detector runs in this process if 1
+    num_shards: Number of shards of symbols; workers by default
+    market_sym: Symbol of the market index, which every shard needs and which is passed 
+    to the detector
+    kwargs: Keyword arguments of the detector, e.g. symbol_change and market_change
+    
+    Returns:
+    df_events: A dataframe filled with either 1's for detected events or NAN's for no events
+    """
+
+    if workers <= 1:
+        return detector(symbols, data_dict, market_sym=market_sym, **kwargs)
+
+    df_close = data_dict["Adj Close"]
+    values = np.ascontiguousarray(df_close.values, dtype=float)
+    positions = df_close.columns.get_indexer(symbols)
+    shards = [shard for shard in np.array_split(positions, num_shards or workers) if len(shard) > 0]
+    market_position = df_close.columns.get_loc(market_sym)
+
+    shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+    try:
+        np.ndarray(values.shape, dtype=float, buffer=shm.buf)[:] = values
+        tasks = [(shm.name, values.shape, df_close.index, df_close.columns, shard, market_position,
+            detector, dict(kwargs, market_sym=market_sym)) for shard in shards]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            masks = list(pool.map(_detect_shard, tasks))
+    finally:
+        shm.close()
+        shm.unlink()
+
+    # Gather the event masks of the shards into one frame with the structure of df_close
+    events = np.full(values.shape, np.nan)
+    for shard, mask in zip(shards, masks):
+        events[:, shard] = np.where(mask, 1.0, np.nan)
+    return pd.DataFrame(events, df_close.index, df_close.columns)
+
+
+def _detect_shard(task):
+    """Run the detector of detect_events_sharded on one shard and return its event mask"""
+    shm_name, shape, index, columns, shard, market_position, detector, kwargs = task
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        panel = np.ndarray(shape, dtype=float, buffer=shm.buf)
+        positions = list(shard) if market_position in shard else list(shard) + [market_position]
+        df_close = pd.DataFrame(panel[:, positions], index, columns[positions])
+        del panel
+        shard_symbols = columns[shard].tolist()
+        df_events = detector(shard_symbols, {"Adj Close": df_close}, **kwargs)
+        return df_events[shard_symbols].values == 1
+    finally:
+        shm.close()
+
+
+def output_events_as_trades(df_events_input, output_filename="df_trades.csv", holding_period=5,
+                            shares=100):
     """
-    Create df_trades based on df_events_input. When an event occurs, buy 100 shares of 
-    the equity on that day; sell automatically 5 trading days later. The df_trades will be 
-    fed into a market simulator to execute trades and measure performance. For the final 
-    few events assume that we exit on the last day, so hold it less than 5 days
+    Create df_trades based on df_events_input. When an event occurs, buy shares of the 
+    equity on that day; sell automatically holding_period trading days later. The df_trades 
+    will be fed into a market simulator to execute trades and measure performance. For the 
+    final few events assume that we exit on the last day, so hold it for fewer days
 
     Parameters:
     df_events_input: A dataframe filled with either 1's for detected events or NAN's for no events
-    output_filename: Name of output file
+    output_filename: Name of output file, or None to skip writing it
+    holding_period: Number of trading days each position is held
+    shares: Number of shares bought and sold per event
 
     Returns:
-    df_trades: A dataframe and a csv file to be used as input to market simulator
-    """
-
-    # Get the date range
-    date_range = get_exchange_days(start_date=df_events_input.index.min(), 
-        end_date=df_events_input.index.max(), dirpath="../../data/dates_lists")
-
-    # Make a copy of df_events_input and drop all-NAN rows and columns
-    # to save time iterating over df_events later
-    df_events = df_events_input.dropna(axis=0, how="all")
-    df_events = df_events.dropna(axis=1, how="all")
-    df_trades = pd.DataFrame(columns=["Date", "Symbol", "Order", "Shares"])
-        
-    for symbol in df_events.columns:
-        for date in df_events.index:
-            if df_events[symbol][date] == 1:
-                df_buy = pd.DataFrame([[date, symbol, "BUY", 100]], columns=df_trades.columns)
-                # If the 5-day hold period is after the last date of the date_range, 
-                # we sell the asset on that last date
-                if date_range.index(date) + 5 >= len(date_range):
-                    sell_date_index = len(date_range) - 1
-                else:
-                    sell_date_index = date_range.index(date) + 5
-                df_sell = pd.DataFrame([[date_range[sell_date_index], symbol, "SELL", 100]], 
-                    columns=df_trades.columns)
-                df_trades = df_trades.append(df_buy)
-                df_trades = df_trades.append(df_sell)
-
-    df_trades.set_index("Date", inplace=True)
-    df_trades.sort_index(inplace=True)
-    df_trades.to_csv(output_filename)
+    df_trades: A dataframe and a csv file to be used as input to market simulator, e.g. 
+    with compute_portvals_from_data
+    """
+
+    # Get the trading calendar; sells are capped at the last date of df_events_input
+    calendar = get_trading_calendar(dirpath="../../data/dates_lists")
+    end_date = df_events_input.index.max() if len(df_events_input) > 0 else None
+
+    # Coordinates of the events, ordered by symbol and then by date
+    symbol_idx, date_idx = np.nonzero(df_events_input.values.T == 1)
+    num_events = len(date_idx)
+    buy_dates = df_events_input.index[date_idx]
+    # If the hold period ends after the last date of the date range, 
+    # we sell the asset on that last date
+    sell_dates = calendar.shift(buy_dates, holding_period, end_date=end_date)
+
+    # Interleave each event's BUY and SELL rows
+    dates = np.empty(2 * num_events, dtype="datetime64[ns]")
+    dates[0::2] = buy_dates.values
+    dates[1::2] = sell_dates.values
+    df_trades = pd.DataFrame({"Symbol": np.repeat(df_events_input.columns.values[symbol_idx], 2),
+                              "Order": np.tile(["BUY", "SELL"], num_events),
+                              "Shares": np.full(2 * num_events, shares)},
+                             index=pd.DatetimeIndex(dates, name="Date"))
+    df_trades.sort_index(kind="mergesort", inplace=True)
+    if output_filename is not None:
+        df_trades.to_csv(output_filename)
 
     return df_trades
 
 
+def simulate_event_trades(df_events_input, data_dict, start_val=1000000, commission=9.95,
+                          impact=0.005, holding_period=5, shares=100, output_filename=None):
+    """
+    Turn events into trades and run them through the market simulator, valuing them with 
+    the prices in data_dict so that nothing is written to or read back from disk
+
+    Parameters:
+    df_events_input: A dataframe filled with either 1's for detected events or NAN's for no events
+    data_dict: A dictionary whose keys are types of data, e.g. Adj Close, Volume, etc. and 
+    values are dataframes with dates as indices and symbols as columns
+    start_val: The starting value of the portfolio (initial cash available)
+    commission: The fixed amount in dollars charged for each transaction (both entry and exit)
+    impact: The amount the price moves against the trader compared to the historical data at each transaction
+    holding_period: Number of trading days each position is held
+    shares: Number of shares bought and sold per event
+    output_filename: Name of a csv file to also write the trades to, or None
+
+    Returns:
+    df_trades: A dataframe of trades as returned by output_events_as_trades
+    portvals: A dataframe with one column containing the value of the portfolio for each trading day
+    """
+
+    # The market simulator is only imported here, so that the detectors and event studies 
+    # do not pull it in (with analysis and scipy) for every importer of this module
+    if '../02a_market_sim' not in sys.path:
+        sys.path.append('../02a_market_sim')
+    from marketsim import compute_portvals_from_data
+
+    df_trades = output_events_as_trades(df_events_input, output_filename, holding_period, shares)
+    portvals = compute_portvals_from_data(df_trades, data_dict, start_val, commission, impact)
+    return df_trades, portvals
+
+
 def plot_events(df_events_input, data_dict, num_backward=20, num_forward=20,
                 output_filename="event_chart", market_neutral=True, error_bars=True,
                 market_sym="SPY"):
@@ -126,7 +229,77 @@ def plot_events(df_events_input, data_dict, num_backward=20, num_forward=20,
     range of [num_backward, num_forward], including the event day
     """
 
-    df_events = df_events_input.copy()
+    mean_returns, std_returns, num_events = get_event_study(df_events_input, data_dict,
+        num_backward, num_forward, market_neutral, market_sym)
+
+    # The date range to be used as the x-axis
+    x_axis_range = range(-num_backward, num_forward + 1)
+
+    # Plot the chart
+    plt.clf()
+    plt.axhline(y=1.0, xmin=-num_backward, xmax=num_forward, color="k")
+    if error_bars == True:
+        plt.errorbar(x_axis_range[num_backward:], mean_returns[num_backward:],
+                    yerr=std_returns[num_backward:], ecolor="r")
+    plt.plot(x_axis_range, mean_returns, linewidth=3, label="mean", color="b")
+    plt.xlim(-num_backward - 1, num_forward + 1)
+    if market_neutral == True:
+        plt.title("Market-relative mean return of {} events".format(num_events))
+    else:
+        plt.title("Mean return of {} events".format(num_events))
+    plt.xlabel("Days")
+    plt.ylabel("Cumulative Returns")
+    plt.savefig(output_filename, format="pdf")
+
+
+def get_event_returns(df_events_input, data_dict, num_backward=20, num_forward=20,
+                      market_neutral=True, market_sym="SPY"):
+    """ 
+    Collect the daily returns around each event found by an event detector
+
+    Parameters:
+    df_events_input: A dataframe filled with 1's for detected events or NAN's for no events
+    data_dict: A dictionary whose keys are types of data, e.g. Adj Close, Volume, etc. and 
+    values are dataframes with dates as indices and symbols as columns
+    num_backward: Number of periods to look back
+    num_forward: Number of periods to look ahead
+    market_neutral: True/False - whether to exclude market return from stock return
+    market_sym: Symbol of the market index
+    
+    Returns:
+    all_events_returns: A numpy ndarray of shape (number of events, num_backward days before 
+    event + 1 event day + num_forward days after event), with the events ordered by symbol, 
+    then by date. Events in the first num_backward and last num_forward rows are ignored
+    """
+
+    df_events, returns = _get_study_returns(df_events_input, data_dict, market_neutral,
+        market_sym)
+
+    # Since we want to look back num_backward rows and ahead num_forward dates of the event,
+    # we ignore the first num_backward and last num_forward rows
+    is_event = df_events.values == 1
+    is_event[0:num_backward, :] = False
+    if num_forward > 0:
+        is_event[-num_forward:, :] = False
+
+    # Coordinates of the events, ordered by symbol and then by date
+    event_cols, event_rows = np.nonzero(is_event.T)
+
+    # A read-only view of every window of num_backward + 1 + num_forward consecutive returns; 
+    # the window of an event on row j starts on row j - num_backward
+    window_length = num_backward + 1 + num_forward
+    if len(returns) < window_length:
+        return np.zeros((0, window_length))
+    windows = np.lib.stride_tricks.sliding_window_view(returns, window_length, axis=0)
+    return windows[event_rows - num_backward, event_cols]
+
+
+def _get_study_returns(df_events_input, data_dict, market_neutral, market_sym):
+    """
+    Return the events without the market if market_neutral, and a numpy ndarray of the 
+    daily returns (net of the market's if market_neutral) of their symbols
+    """
+    df_events = df_events_input
     
     # Compute daily return
     df_returns = compute_daily_returns(data_dict["Adj Close"])
@@ -134,63 +307,334 @@ def plot_events(df_events_input, data_dict, num_backward=20, num_forward=20,
     if market_neutral == True:
         # Substract market returns from all returns of all symbols
         df_returns = df_returns.sub(df_returns[market_sym].values, axis=0)
-        del df_returns[market_sym]
-        del df_events[market_sym]
+        df_events = df_events.drop(columns=[market_sym])
 
-    # Since we want to look back num_backward rows and ahead num_forward dates of the event,
-    # we ignore the first num_backward and last num_forward rows, and replace them with NAN's
-    df_events.values[0:num_backward, :] = np.NaN
-    if num_forward > 0:
-        df_events.values[-num_forward:, :] = np.NaN
+    return df_events, df_returns[df_events.columns].values
+
+
+def get_event_study(df_events_input, data_dict, num_backward=20, num_forward=20,
+                    market_neutral=True, market_sym="SPY"):
+    """ 
+    Compute the means and standard deviations of the cumulative returns around events, 
+    without plotting them
+
+    Parameters:
+    See get_event_returns
+    
+    Returns:
+    mean_returns: A numpy ndarray of the means of the cumulative returns within the date 
+    range of [num_backward, num_forward], normalized by the event day
+    std_returns: A numpy ndarray of their standard deviations
+    num_events: Number of events
+    """
+
+    all_events_returns = get_event_returns(df_events_input, data_dict, num_backward,
+        num_forward, market_neutral, market_sym)
 
     # Number of events
-    num_events = int(df_events.count().sum())
+    num_events = len(all_events_returns)
     assert num_events > 0, "Zero events in the event matrix"
-    all_events_returns = []
-
-    # Look for the events and add them to a numpy ndarray which has shape of
-    # (num_events, num_backward days before event + 1 event day + num_forward days after event)
-    for symbol in df_events.columns:
-        for j, event_date in enumerate(df_events.index):
-            if df_events[symbol][event_date] == 1:
-                single_event_returns = df_returns[symbol][j - num_backward:j + 1 + num_forward]
-                if type(all_events_returns) == type([]):
-                    all_events_returns = single_event_returns
-                else:
-                    all_events_returns = np.vstack((all_events_returns, single_event_returns))
-
-    # If there is only 1 event, ensure that the ndarray has the above mentioned shape
-    if len(all_events_returns.shape) == 1:
-        all_events_returns = np.expand_dims(all_events_returns, axis=0)
+
+    all_events_returns = compute_event_cumulative_returns(all_events_returns, num_backward)
+
+    # Compute the means and standard deviations
+    mean_returns = np.mean(all_events_returns, axis=0)
+    std_returns = np.std(all_events_returns, axis=0)
+
+    return mean_returns, std_returns, num_events
+
+
+def compute_event_cumulative_returns(all_events_returns, num_backward):
+    """ 
+    Turn the daily returns around events into cumulative returns normalized by the event day
+
+    Parameters:
+    all_events_returns: A numpy ndarray of daily returns as returned by get_event_returns
+    num_backward: Number of periods looked back, i.e. the column of the event day
+
+    Returns:
+    all_events_returns: A numpy ndarray of the same shape with the cumulative returns
+    """
 
     # Compute cumulative product returns
     all_events_returns = np.cumprod(all_events_returns + 1, axis=1)
 
     # Normalize cumulative returns by event day
-    all_events_returns = (all_events_returns.T / all_events_returns[:, num_backward]).T
+    return (all_events_returns.T / all_events_returns[:, num_backward]).T
 
-    # Compute the means and standard deviations
+
+class EventStudyAccumulator(object):
+    """
+    Running means and standard deviations of the cumulative returns around events, for 
+    each day of the window. Only the count, mean and sum of squared deviations (M2) of each 
+    day are kept, so memory does not grow with the number of events. Batches are combined 
+    with the parallel form of Welford's algorithm, and accumulators built from different 
+    chunks of symbols or in different processes can be merged.
+    """
+
+    def __init__(self, num_backward=20, num_forward=20):
+        self.num_backward = num_backward
+        self.num_forward = num_forward
+        self.count = 0
+        self.mean = np.zeros(num_backward + 1 + num_forward)
+        self.m2 = np.zeros(num_backward + 1 + num_forward)
+
+    def add(self, all_events_returns):
+        """
+        Add a batch of events
+
+        Parameters:
+        all_events_returns: A numpy ndarray of cumulative returns as returned by 
+        compute_event_cumulative_returns
+
+        Returns:
+        self
+        """
+
+        if len(all_events_returns) > 0:
+            batch_mean = np.mean(all_events_returns, axis=0)
+            batch_m2 = np.sum((all_events_returns - batch_mean) ** 2, axis=0)
+            self._combine(len(all_events_returns), batch_mean, batch_m2)
+        return self
+
+    def merge(self, other):
+        """Add the events of another accumulator with the same window, and return self"""
+        if other.count > 0:
+            self._combine(other.count, other.mean, other.m2)
+        return self
+
+    def std(self):
+        """Return the standard deviations of the cumulative returns, as np.std computes them"""
+        return np.sqrt(self.m2 / self.count)
+
+    def _combine(self, count, mean, m2):
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * count / total
+        self.m2 = self.m2 + m2 + delta ** 2 * self.count * count / total
+        self.count = total
+
+
+def accumulate_event_study(df_events_input, data_dict, num_backward=20, num_forward=20,
+                           market_neutral=True, market_sym="SPY", chunk_size=50,
+                           workers=1, executor="thread"):
+    """ 
+    Compute the same means and standard deviations as get_event_study, processing the 
+    symbols in chunks so that only one chunk's event windows are in memory at a time
+
+    Parameters:
+    df_events_input, data_dict, num_backward, num_forward, market_neutral, market_sym: 
+    See get_event_returns
+    chunk_size: Number of symbols per chunk
+    workers, executor: See map_tasks; each chunk is one task
+    
+    Returns:
+    accumulator: An EventStudyAccumulator whose mean, std() and count are the mean returns, 
+    standard deviations and number of events
+    """
+
+    symbols = [symbol for symbol in df_events_input.columns
+        if not (market_neutral == True and symbol == market_sym)]
+    chunks = [symbols[i:i + chunk_size] for i in range(0, len(symbols), chunk_size)]
+    # Each task only carries its own symbols and the market, so a process pool does not 
+    # pickle the whole universe once per chunk
+    tasks = []
+    for chunk in chunks:
+        columns = chunk + [market_sym] if market_neutral == True else chunk
+        tasks.append((df_events_input[columns], data_dict["Adj Close"][columns], num_backward,
+            num_forward, market_neutral, market_sym))
+
+    accumulator = EventStudyAccumulator(num_backward, num_forward)
+    for result in map_tasks(_accumulate_chunk, tasks, workers, executor):
+        accumulator.merge(result)
+    return accumulator
+
+
+def _accumulate_chunk(task):
+    """Build an EventStudyAccumulator for one chunk of symbols of accumulate_event_study"""
+    df_events, df_close, num_backward, num_forward, market_neutral, market_sym = task
+    all_events_returns = get_event_returns(df_events, {"Adj Close": df_close}, num_backward,
+        num_forward, market_neutral, market_sym)
+    accumulator = EventStudyAccumulator(num_backward, num_forward)
+    return accumulator.add(compute_event_cumulative_returns(all_events_returns, num_backward))
+
+
+def bootstrap_event_study(df_events_input, data_dict, num_backward=20, num_forward=20,
+                          market_neutral=True, market_sym="SPY", num_resamples=1000,
+                          confidence=0.95, batch_size=100, seed=0, workers=1, executor="thread"):
+    """ 
+    Bootstrap confidence intervals for the mean cumulative returns around events. Events 
+    are resampled with replacement; each batch of resamples is drawn as counts per event 
+    and averaged with one matrix product. Every batch has its own random generator spawned 
+    from seed, so the results do not depend on workers. With a process pool, the event 
+    windows are copied once into shared memory instead of being pickled with every batch
+
+    Parameters:
+    df_events_input, data_dict, num_backward, num_forward, market_neutral, market_sym: 
+    See get_event_returns
+    num_resamples: Number of bootstrap resamples
+    confidence: Confidence level of the intervals
+    batch_size: Number of resamples per batch
+    seed: Seed of the random generators
+    workers, executor: See map_tasks; each batch is one task
+    
+    Returns:
+    mean_returns: A numpy ndarray of the means of the cumulative returns, as in get_event_study
+    lower: A numpy ndarray of the lower bounds of the confidence intervals
+    upper: A numpy ndarray of the upper bounds of the confidence intervals
+    bootstrap_means: A numpy ndarray of shape (num_resamples, length of the window) of the 
+    mean cumulative returns of each resample
+    """
+
+    all_events_returns = compute_event_cumulative_returns(get_event_returns(df_events_input,
+        data_dict, num_backward, num_forward, market_neutral, market_sym), num_backward)
+    assert len(all_events_returns) > 0, "Zero events in the event matrix"
     mean_returns = np.mean(all_events_returns, axis=0)
-    std_returns = np.std(all_events_returns, axis=0)
 
-    # The date range to be used as the x-axis
-    x_axis_range = range(-num_backward, num_forward + 1)
+    batches = _split_resamples(num_resamples, batch_size, seed)
+    bootstrap_means = np.concatenate(_map_shared_arrays(_bootstrap_batch, [all_events_returns],
+        batches, workers, executor))
 
-    # Plot the chart
-    plt.clf()
-    plt.axhline(y=1.0, xmin=-num_backward, xmax=num_forward, color="k")
-    if error_bars == True:
-        plt.errorbar(x_axis_range[num_backward:], mean_returns[num_backward:],
-                    yerr=std_returns[num_backward:], ecolor="r")
-    plt.plot(x_axis_range, mean_returns, linewidth=3, label="mean", color="b")
-    plt.xlim(-num_backward - 1, num_forward + 1)
-    if market_neutral == True:
-        plt.title("Market-relative mean return of {} events".format(num_events))
-    else:
-        plt.title("Mean return of {} events".format(num_events))
-    plt.xlabel("Days")
-    plt.ylabel("Cumulative Returns")
-    plt.savefig(output_filename, format="pdf")
+    tail = (1 - confidence) / 2 * 100
+    lower, upper = np.percentile(bootstrap_means, [tail, 100 - tail], axis=0)
+    return mean_returns, lower, upper, bootstrap_means
+
+
+def placebo_event_study(df_events_input, data_dict, num_backward=20, num_forward=20,
+                        market_neutral=True, market_sym="SPY", num_resamples=1000,
+                        batch_size=100, seed=0, workers=1, executor="thread"):
+    """ 
+    Compare the mean cumulative returns around events with those around random dates. 
+    Each placebo resample draws as many (symbol, date) pairs as there are events, uniformly 
+    among the symbols and dates with a full window without NAN returns, and computes their 
+    mean cumulative returns as get_event_study does. Batches are seeded and shared with the 
+    workers as in bootstrap_event_study
+
+    Parameters:
+    df_events_input, data_dict, num_backward, num_forward, market_neutral, market_sym: 
+    See get_event_returns
+    num_resamples: Number of placebo resamples
+    batch_size: Number of resamples per batch; each batch gathers batch_size x number of 
+    events windows at once
+    seed: Seed of the random generators
+    workers, executor: See map_tasks; each batch is one task
+    
+    Returns:
+    mean_returns: A numpy ndarray of the means of the cumulative returns, as in get_event_study
+    placebo_means: A numpy ndarray of shape (num_resamples, length of the window) of the 
+    mean cumulative returns of each placebo resample
+    p_values: A numpy ndarray of the two-sided p-values of mean_returns, i.e. the fraction 
+    of placebo means at least as far from the average placebo mean; NAN's where mean_returns 
+    or the placebo means are NAN's
+    """
+
+    all_events_returns = compute_event_cumulative_returns(get_event_returns(df_events_input,
+        data_dict, num_backward, num_forward, market_neutral, market_sym), num_backward)
+    num_events = len(all_events_returns)
+    assert num_events > 0, "Zero events in the event matrix"
+    mean_returns = np.mean(all_events_returns, axis=0)
+
+    df_events, returns = _get_study_returns(df_events_input, data_dict, market_neutral,
+        market_sym)
+
+    # Windows without any NAN return, as flat positions first row of the window * number of 
+    # symbols + column
+    window_length = num_backward + 1 + num_forward
+    nans = np.concatenate((np.zeros((1, returns.shape[1])), np.cumsum(np.isnan(returns), axis=0)))
+    window_starts = np.flatnonzero(nans[window_length:] == nans[:-window_length])
+    assert len(window_starts) > 0, "Zero windows without NAN's for the placebo"
+
+    batches = [(num_events, num_backward, num_forward, size, batch_seed) for size, batch_seed in
+        _split_resamples(num_resamples, batch_size, seed)]
+    placebo_means = np.concatenate(_map_shared_arrays(_placebo_batch, [returns, window_starts],
+        batches, workers, executor))
+
+    center = np.mean(placebo_means, axis=0)
+    p_values = np.mean(np.abs(placebo_means - center) >= np.abs(mean_returns - center), axis=0)
+    # A NAN mean compares as False against everything, which would read as significant
+    p_values[np.isnan(mean_returns) | np.isnan(center)] = np.nan
+    return mean_returns, placebo_means, p_values
+
+
+def _split_resamples(num_resamples, batch_size, seed):
+    """Return the size and the seed of each batch of resamples"""
+    sizes = [min(batch_size, num_resamples - start) for start in range(0, num_resamples,
+        batch_size)]
+    return list(zip(sizes, np.random.SeedSequence(seed).spawn(len(sizes))))
+
+
+def _map_shared_arrays(func, arrays, batches, workers, executor):
+    """
+    Run func(arrays, *batch) on every batch with map_tasks. With a process pool the arrays 
+    are copied once into shared memory, which every worker maps, so they are not pickled 
+    with each batch
+    """
+    if not (workers > 1 and executor == "process" and len(batches) > 1):
+        return map_tasks(_run_batch, [(func, arrays, batch) for batch in batches], workers,
+            executor)
+
+    blocks = []
+    try:
+        specs = []
+        for array in arrays:
+            shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            blocks.append(shm)
+            np.ndarray(array.shape, array.dtype, buffer=shm.buf)[:] = array
+            specs.append((shm.name, array.shape, array.dtype.str))
+        return map_tasks(_run_shared_batch, [(func, specs, batch) for batch in batches], workers,
+            executor)
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+
+def _run_batch(task):
+    """Run func(arrays, *batch) for _map_shared_arrays"""
+    func, arrays, batch = task
+    return func(arrays, *batch)
+
+
+def _run_shared_batch(task):
+    """Map the shared arrays of _map_shared_arrays and run func(arrays, *batch) on them"""
+    func, specs, batch = task
+    blocks = [shared_memory.SharedMemory(name=name) for name, _, _ in specs]
+    try:
+        arrays = [np.ndarray(shape, dtype, buffer=shm.buf) for shm, (_, shape, dtype)
+            in zip(blocks, specs)]
+        result = func(arrays, *batch)
+        del arrays
+        return result
+    finally:
+        for shm in blocks:
+            shm.close()
+
+
+def _bootstrap_batch(arrays, size, batch_seed):
+    """Compute the mean cumulative returns of a batch of bootstrap resamples"""
+    all_events_returns, = arrays
+    num_events = len(all_events_returns)
+    rng = np.random.default_rng(batch_seed)
+
+    # Number of times each event is drawn in each resample
+    draws = rng.integers(0, num_events, (size, num_events))
+    draws += np.arange(size)[:, None] * num_events
+    counts = np.bincount(draws.ravel(), minlength=size * num_events).reshape(size, num_events)
+    return counts.dot(all_events_returns) / num_events
+
+
+def _placebo_batch(arrays, num_events, num_backward, num_forward, size, batch_seed):
+    """Compute the mean cumulative returns of a batch of placebo resamples"""
+    returns, window_starts = arrays
+    rng = np.random.default_rng(batch_seed)
+    window_length = num_backward + 1 + num_forward
+    windows = np.lib.stride_tricks.sliding_window_view(returns, window_length, axis=0)
+
+    # The windows of all resamples at once, drawn as a (size, num_events) matrix
+    draws = window_starts[rng.integers(0, len(window_starts), (size, num_events))]
+    rows, cols = np.divmod(draws.ravel(), returns.shape[1])
+    all_events_returns = compute_event_cumulative_returns(windows[rows, cols], num_backward)
+    return np.mean(all_events_returns.reshape(size, num_events, window_length), axis=1)
 
 
 if __name__ == "__main__":
@@ -219,5 +663,7 @@ if __name__ == "__main__":
                 output_filename="event_chart.pdf", market_neutral=True, error_bars=True,
                 market_sym="SPY")
     
-    # Output the event as trades to be fed into marketsim
-    df_trades = output_events_as_trades(df_events, "df_trades.csv")
+    # Output the event as trades to be fed into marketsim, and simulate them with the 
+    # prices already loaded
+    df_trades, portvals = simulate_event_trades(df_events, data_dict, output_filename="df_trades.csv")
+    print ("Final Portfolio Value: {}".format(portvals.iloc[-1, -1]))
@@ -2,13 +2,14 @@
 
 import os
 import pandas as pd
+import numpy as np
 import matplotlib.pyplot as plt
 import copy
 import sys
 # Append the path of the directory one level above the current directory to import util
 sys.path.append("../")
 from util import *
-from event_analyzer import output_events_as_trades, plot_events
+from event_analyzer import output_events_as_trades, plot_events, simulate_event_trades
 
 
 def get_bollinger_bands(rolling_mean, rolling_std, num_std=2):
@@ -101,7 +102,7 @@ def plot_bollinger(symbol, start_date, end_date, window=20, num_std=1):
 
 
 def detect_bollinger(symbols, data_dict, window=20, 
-    symbol_bv_change=-2.0, market_bv_change=1.0):
+    symbol_bv_change=-2.0, market_bv_change=1.0, market_sym="SPY"):
     """ 
     Create the event dataframe based on changes in Bollinger values. Here we are only 
     interested in the opposite movements of symbol and market, i.e. symbol_bv_change 
@@ -114,59 +115,198 @@ def detect_bollinger(symbols, data_dict, window=20,
     window: Number of days to look back for rolling_mean and rolling_std
     symbol_bv_change: Change in the Bollinger value of symbol
     market_bv_change: Change in the Bollinger value of market
+    market_sym: Symbol of the market index
     
     Returns:
     df_events: A dataframe filled with either 1's for detected events or NAN's for no events
     """
 
     df_close = data_dict["Adj Close"]
-    market_close = df_close["SPY"]
+    market_close = df_close[market_sym]
 
     # Create a dataframe filled with NAN's
-    df_events = copy.deepcopy(df_close)
-    df_events = df_events * np.NAN
+    df_events = df_close * np.nan
 
-    # Dates for the event range
-    dates = df_close.index
+    if not (symbol_bv_change < 0 and market_bv_change > 0) and \
+        not (symbol_bv_change > 0 and market_bv_change < 0):
+        print ("Here we are only interested in the opposite movements of symbol and market, \
+            i.e. you should ensure symbol_bv_change and market_bv_change are of opposite signs")
+        return df_events
 
-    # Compute rolling mean for market
+    # Compute rolling mean, rolling standard deviation and Bollinger value for market
     market_rm = market_close.rolling(window=window).mean()
-
-    # Compute rolling standard deviation for market
     market_rstd = market_close.rolling(window=window).std()
+    market_bv = compute_bollinger_value(market_close, market_rm, market_rstd).values
+
+    # Compute them for all symbols at once
+    symbol_close = df_close[symbols]
+    symbol_rm = symbol_close.rolling(window=window).mean()
+    symbol_rstd = symbol_close.rolling(window=window).std()
+    symbol_bv = compute_bollinger_value(symbol_close, symbol_rm, symbol_rstd).values
+
+    # Compare the Bollinger values today with those yesterday by shifting the arrays one day; 
+    # only dates from index window onwards are considered
+    symbol_bv_yesterday = symbol_bv[window - 1:-1]
+    symbol_bv_today = symbol_bv[window:]
+    market_bv_today = market_bv[window:, None]
+
+    # Event is found if both the symbol and market cross their respective thresholds
+    with np.errstate(invalid="ignore"):
+        if symbol_bv_change < 0:
+            is_event = (symbol_bv_yesterday >= symbol_bv_change) & \
+                (symbol_bv_today <= symbol_bv_change) & (market_bv_today >= market_bv_change)
+        else:
+            is_event = (symbol_bv_yesterday <= symbol_bv_change) & \
+                (symbol_bv_today >= symbol_bv_change) & (market_bv_today <= market_bv_change)
+
+    events = np.full(symbol_bv.shape, np.nan)
+    events[window:][is_event] = 1.0
+    df_events[symbols] = events
+    return df_events
+
+
+def sweep_bollinger(symbols, data_dict, windows=(10, 20, 30), symbol_bv_changes=(-2.0, -1.5, -1.0),
+    market_bv_changes=(0.5, 1.0, 1.5), num_backward=20, num_forward=20, market_sym="SPY",
+    workers=1, executor="thread"):
+    """
+    Run detect_bollinger over a grid of parameters and summarize each event study. The 
+    rolling sums and sums of squares of all windows come from one cumulative sum of the 
+    prices, so each window costs O(1) per point, and all threshold pairs of a window share 
+    its Bollinger values. Events equal those of detect_bollinger, except for Bollinger 
+    values within rounding error of a threshold
+
+    Parameters:
+    symbols: A list of symbols of interest
+    data_dict: A dictionary whose keys are types of data, e.g. Adj Close, Volume, etc. and 
+    values are dataframes with dates as indices and symbols as columns
+    windows: Numbers of days to look back for rolling_mean and rolling_std
+    symbol_bv_changes: Changes in the Bollinger value of symbol
+    market_bv_changes: Changes in the Bollinger value of market; only pairs of opposite 
+    signs are evaluated
+    num_backward: Events in the first num_backward days are left out of the summary, as in plot_events
+    num_forward: Number of days after the event over which the return is measured
+    market_sym: Symbol of the market index, whose Bollinger values are compared and whose 
+    returns are subtracted as in plot_events
+    workers, executor: See map_tasks; each window is one task
 
-    # Compute Bollinger value for market
-    market_bv = compute_bollinger_value(market_close, market_rm, market_rstd)
-
-    for symbol in symbols:
-        # Compute rolling mean for symbol
-        symbol_rm = df_close[symbol].rolling(window=window).mean()
-
-        # Compute rolling standard deviation for symbol
-        symbol_rstd = df_close[symbol].rolling(window=window).std()
-
-        # Compute Bollinger value for symbol
-        symbol_bv = compute_bollinger_value(df_close[symbol], symbol_rm, symbol_rstd)
-
-        for i in range(window, len(dates)):
-            # Get the Bollinger values today and yesterday
-            symbol_bv_yesterday = symbol_bv.loc[dates[i - 1]]
-            symbol_bv_today = symbol_bv.loc[dates[i]]
-            market_bv_today = market_bv.loc[dates[i]]
-
-            # Event is found if both the symbol and market cross their respective thresholds
-            if symbol_bv_change < 0 and market_bv_change > 0:
-                if symbol_bv_yesterday >= symbol_bv_change and \
-                symbol_bv_today <= symbol_bv_change and market_bv_today >= market_bv_change:
-                    df_events[symbol].loc[dates[i]] = 1
-            elif symbol_bv_change > 0 and market_bv_change < 0:
-                if symbol_bv_yesterday <= symbol_bv_change and \
-                symbol_bv_today >= symbol_bv_change and market_bv_today <= market_bv_change:
-                    df_events[symbol].loc[dates[i]] = 1
+    Returns:
+    df_sweep: A dataframe with one row per parameter set and columns window, symbol_bv_change, 
+    market_bv_change, num_events (all detected events), num_study_events (events with 
+    num_backward days before and num_forward days after, and no NAN return in the 
+    num_forward days), mean_return and std_return (of the market-relative cumulative 
+    return num_forward days after the event) and win_rate (fraction of those returns above 
+    zero)
+    """
+
+    df_close = data_dict["Adj Close"]
+    prices = df_close[symbols].values
+    market_prices = df_close[market_sym].values
+
+    # Cumulative sums of prices, squared prices and NAN counts, with a leading row of zeros. 
+    # Prices are centered on each column's mean first, which leaves the standard deviation 
+    # unchanged and keeps the sums small
+    cumsums = [_price_cumsums(prices), _price_cumsums(market_prices[:, None])]
+
+    # Market-relative daily growth, as in plot_events
+    daily_returns = compute_daily_returns(df_close)
+    daily_returns = daily_returns.sub(daily_returns[market_sym].values, axis=0)
+    growth = daily_returns[symbols].values + 1
+
+    pairs = [(symbol_bv_change, market_bv_change) for symbol_bv_change in symbol_bv_changes
+        for market_bv_change in market_bv_changes if symbol_bv_change * market_bv_change < 0]
+    tasks = [(window, prices, market_prices, cumsums, growth, pairs, num_backward, num_forward)
+        for window in windows]
+
+    results = map_tasks(_sweep_window, tasks, workers, executor)
+
+    return pd.DataFrame([row for rows in results for row in rows], columns=["window",
+        "symbol_bv_change", "market_bv_change", "num_events", "num_study_events", "mean_return",
+        "std_return", "win_rate"])
+
+
+def _price_cumsums(prices):
+    """
+    Return the cumulative sums of centered prices, squared centered prices, NAN counts and 
+    price changes, and the centered prices
+    """
+    is_nan = np.isnan(prices)
+    with np.errstate(invalid="ignore"):
+        centered = prices - np.nanmean(prices, axis=0)
+    centered[is_nan] = 0.0
+    zeros = np.zeros((1, prices.shape[1]))
+    changes = np.concatenate((zeros, prices[1:] != prices[:-1]))
+    return (np.concatenate((zeros, np.cumsum(centered, axis=0))),
+        np.concatenate((zeros, np.cumsum(centered ** 2, axis=0))),
+        np.concatenate((zeros, np.cumsum(is_nan, axis=0))),
+        np.concatenate((zeros, np.cumsum(changes, axis=0))),
+        centered)
+
+
+def _rolling_bollinger_value(cumsums, window):
+    """Compute Bollinger values for a window from the cumulative sums of _price_cumsums"""
+    sums, squares, nans, changes, centered = cumsums
+    window_sum = np.full(centered.shape, np.nan)
+    window_squares = np.full(centered.shape, np.nan)
+    window_nans = np.ones(centered.shape)
+    window_changes = np.ones(centered.shape)
+    window_sum[window - 1:] = sums[window:] - sums[:-window]
+    window_squares[window - 1:] = squares[window:] - squares[:-window]
+    window_nans[window - 1:] = nans[window:] - nans[:-window]
+    window_changes[window - 1:] = changes[window:] - changes[1:len(changes) - window + 1]
+
+    rolling_mean = window_sum / window
+    with np.errstate(invalid="ignore", divide="ignore"):
+        variance = np.maximum(window_squares - window_sum * rolling_mean, 0.0) / (window - 1)
+        bollinger_val = compute_bollinger_value(centered, rolling_mean, np.sqrt(variance))
+    # A window of equal prices has no spread, like 0 / 0 in detect_bollinger
+    bollinger_val[(window_nans > 0) | (window_changes == 0)] = np.nan
+    return bollinger_val
+
+
+def _sweep_window(task):
+    """Evaluate all threshold pairs for one window of sweep_bollinger"""
+    window, prices, market_prices, cumsums, growth, pairs, num_backward, num_forward = task
+    symbol_bv = _rolling_bollinger_value(cumsums[0], window)
+    market_bv = _rolling_bollinger_value(cumsums[1], window)[:, 0]
+    symbol_bv[np.isnan(prices)] = np.nan
+
+    # Yesterday and today, for dates from index window onwards, as in detect_bollinger
+    symbol_bv_yesterday = symbol_bv[window - 1:-1]
+    symbol_bv_today = symbol_bv[window:]
+    market_bv_today = market_bv[window:, None]
+
+    num_dates = len(prices)
+    if num_forward > 0:
+        # Every run of num_forward daily growths; the run after an event on row j starts on row j + 1
+        forward_growth = np.lib.stride_tricks.sliding_window_view(growth, num_forward, axis=0)
+    rows = []
+    for symbol_bv_change, market_bv_change in pairs:
+        with np.errstate(invalid="ignore"):
+            if symbol_bv_change < 0:
+                is_event = (symbol_bv_yesterday >= symbol_bv_change) & \
+                    (symbol_bv_today <= symbol_bv_change) & (market_bv_today >= market_bv_change)
             else:
-                print ("Here we are only interested in the opposite movements of symbol and market, \
-                    i.e. you should ensure symbol_bv_change and market_bv_change are of opposite signs")
-    return df_events
+                is_event = (symbol_bv_yesterday <= symbol_bv_change) & \
+                    (symbol_bv_today >= symbol_bv_change) & (market_bv_today <= market_bv_change)
+        event_rows, event_cols = np.nonzero(is_event)
+        event_rows = event_rows + window
+
+        # Cumulative market-relative return num_forward days after each event
+        in_study = (event_rows >= num_backward) & (event_rows < num_dates - num_forward)
+        study_rows, study_cols = event_rows[in_study], event_cols[in_study]
+        if num_forward > 0:
+            returns = np.prod(forward_growth[study_rows + 1, study_cols], axis=1) - 1
+        else:
+            returns = np.zeros(len(study_rows))
+        # A NAN return within the run only spoils that event
+        returns = returns[~np.isnan(returns)]
+        if len(returns) > 0:
+            summary = [np.mean(returns), np.std(returns), np.mean(returns > 0)]
+        else:
+            summary = [np.nan, np.nan, np.nan]
+        rows.append([window, symbol_bv_change, market_bv_change, len(event_rows),
+            len(returns)] + summary)
+    return rows
 
 
 if __name__ == "__main__":
@@ -198,5 +338,8 @@ if __name__ == "__main__":
                 output_filename="bollinger_event_chart.pdf", market_neutral=True, error_bars=True,
                 market_sym="SPY")
     
-    # Output the event as trades to be fed into marketsim
-    df_trades = output_events_as_trades(df_events, "df_trades_bollinger.csv")
\ No newline at end of file
+    # Output the event as trades to be fed into marketsim, and simulate them with the 
+    # prices already loaded
+    df_trades, portvals = simulate_event_trades(df_events, data_dict,
+        output_filename="df_trades_bollinger.csv")
+    print ("Final Portfolio Value: {}".format(portvals.iloc[-1, -1]))
\ No newline at end of file
@@ -0,0 +1,177 @@
+"""Rolling indicators updated one tick at a time"""
+
+import numpy as np
+import pandas as pd
+from event_analyzer_bollinger import get_bollinger_bands, compute_bollinger_value
+
+
+class RollingStats(object):
+    """
+    Rolling mean and standard deviation of the prices of a universe of symbols, updated
+    in constant time per symbol with each new row of prices. The variance is kept with
+    Welford's running algorithm, adding the newest price and removing the one leaving the
+    window. It is recomputed exactly from the window every resync ticks, and whenever it
+    becomes too small to trust, to stop rounding errors from piling up. As with pandas'
+    rolling(window), the results are NAN's until the window is full and while a NAN price
+    is in the window.
+    """
+
+    def __init__(self, window, num_symbols, resync=10000):
+        self.window = window
+        self.num_symbols = num_symbols
+        self.resync = resync
+        self.num_ticks = 0
+        # Ring buffer of the last window prices
+        self.prices = np.full((window, num_symbols), np.nan)
+        self.count = np.zeros(num_symbols)
+        self.mean = np.zeros(num_symbols)
+        self.m2 = np.zeros(num_symbols)
+
+    def warm_start(self, history):
+        """
+        Feed past prices, so that the next update continues from them
+
+        Parameters:
+        history: A dataframe or a 2-D array with dates as rows and symbols as columns;
+        only its last window rows matter
+
+        Returns:
+        self
+        """
+
+        for prices in np.asarray(history, dtype=float)[-self.window:]:
+            self.update(prices)
+        return self
+
+    def update(self, prices):
+        """
+        Add a new row of prices
+
+        Parameters:
+        prices: An array with one price per symbol
+
+        Returns:
+        rolling_mean: An array of the rolling means of the symbols
+        rolling_std: An array of the rolling (sample) standard deviations of the symbols
+        """
+
+        prices = np.asarray(prices, dtype=float)
+        slot = self.num_ticks % self.window
+        self._remove(self.prices[slot])
+        self.prices[slot] = prices
+        self._add(prices)
+        self.num_ticks += 1
+        if self.num_ticks % self.resync == 0:
+            self._recompute(np.ones(self.num_symbols, dtype=bool))
+        else:
+            # A variance that is tiny next to the squared mean has lost most of its digits
+            # to cancellation; recompute it from the window
+            flat = self.m2 < self.window * 1e-6 * self.mean ** 2
+            if flat.any():
+                self._recompute(flat)
+        return self.rolling_mean(), self.rolling_std()
+
+    def rolling_mean(self):
+        """Return the rolling means of the symbols, NAN where the window is not full"""
+        return np.where(self.count == self.window, self.mean, np.nan)
+
+    def rolling_std(self):
+        """Return the rolling standard deviations of the symbols, NAN where the window is not full"""
+        if self.window < 2:
+            return np.full(self.num_symbols, np.nan)
+        variance = np.maximum(self.m2, 0.0) / (self.window - 1)
+        return np.where(self.count == self.window, np.sqrt(variance), np.nan)
+
+    def _add(self, values):
+        valid = ~np.isnan(values)
+        self.count[valid] += 1
+        delta = values[valid] - self.mean[valid]
+        self.mean[valid] += delta / self.count[valid]
+        self.m2[valid] += delta * (values[valid] - self.mean[valid])
+
+    def _remove(self, values):
+        valid = ~np.isnan(values)
+        self.count[valid] -= 1
+        empty = valid & (self.count == 0)
+        self.mean[empty] = 0.0
+        self.m2[empty] = 0.0
+        valid = valid & ~empty
+        delta = values[valid] - self.mean[valid]
+        self.mean[valid] -= delta / self.count[valid]
+        self.m2[valid] -= delta * (values[valid] - self.mean[valid])
+
+    def _recompute(self, columns):
+        prices = self.prices[:, columns]
+        valid = ~np.isnan(prices)
+        count = valid.sum(axis=0).astype(float)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.where(count > 0, np.where(valid, prices, 0.0).sum(axis=0) / count, 0.0)
+        self.count[columns] = count
+        self.mean[columns] = mean
+        self.m2[columns] = (np.where(valid, prices - mean, 0.0) ** 2).sum(axis=0)
+
+
+class StreamingBollinger(object):
+    """
+    Bollinger values and bands of a universe of symbols, updated in constant time per
+    symbol with each new row of prices. They match compute_bollinger_value and
+    get_bollinger_bands applied to pandas' rolling(window).mean() and .std()
+    """
+
+    def __init__(self, window, num_symbols, num_std=2, resync=10000):
+        self.num_std = num_std
+        self.stats = RollingStats(window, num_symbols, resync)
+        self.bollinger_val = np.full(num_symbols, np.nan)
+
+    def warm_start(self, history):
+        """Feed past prices (see RollingStats.warm_start) and return self"""
+        history = np.asarray(history, dtype=float)
+        self.stats.warm_start(history)
+        if len(history) > 0:
+            with np.errstate(invalid="ignore", divide="ignore"):
+                self.bollinger_val = compute_bollinger_value(history[-1],
+                    self.stats.rolling_mean(), self.stats.rolling_std())
+        return self
+
+    def update(self, prices):
+        """
+        Add a new row of prices
+
+        Parameters:
+        prices: An array with one price per symbol
+
+        Returns:
+        bollinger_val: An array of the number of standard deviations each price is from its
+        rolling mean
+        """
+
+        prices = np.asarray(prices, dtype=float)
+        rolling_mean, rolling_std = self.stats.update(prices)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.bollinger_val = compute_bollinger_value(prices, rolling_mean, rolling_std)
+        return self.bollinger_val
+
+    def bands(self):
+        """Return the upper and lower Bollinger bands as of the last update"""
+        return get_bollinger_bands(self.stats.rolling_mean(), self.stats.rolling_std(),
+            self.num_std)
+
+
+def streaming_bollinger_values(df_close, window=20, num_std=2):
+    """
+    Replay a dataframe of prices through a StreamingBollinger, e.g. to check it against
+    the offline computation
+
+    Parameters:
+    df_close: A dataframe with dates as indices and symbols as columns
+    window: Number of days to look back for the rolling mean and rolling std
+    num_std: Number of standard deviations for the bands
+
+    Returns:
+    df_bollinger_val: A dataframe of Bollinger values with the same structure as df_close
+    """
+
+    bollinger = StreamingBollinger(window, df_close.shape[1], num_std)
+    values = [bollinger.update(prices) for prices in df_close.values]
+    return pd.DataFrame(np.array(values).reshape(df_close.shape), df_close.index,
+        df_close.columns)
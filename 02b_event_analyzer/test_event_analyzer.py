@@ -0,0 +1,262 @@
+"""Test for event_analyzer.py"""
+
+
+from event_analyzer import placebo_event_study, bootstrap_event_study, get_event_study, \
+    detect_return_diff, detect_events_sharded, get_event_returns, output_events_as_trades
+from event_analyzer_bollinger import detect_bollinger, sweep_bollinger
+from streaming_indicators import streaming_bollinger_values
+import unittest
+import numpy as np
+import pandas as pd
+import sys
+# Append the path of the directory one level above the current directory to import util
+sys.path.append('../')
+from util import get_trading_calendar
+
+
+def make_prices(num_days=120, seed=0):
+    """Random walk prices of a few symbols and SPY, with NAN's in the prices of BAD"""
+    rng = np.random.default_rng(seed)
+    symbols = ["AAA", "BBB", "CCC", "BAD", "SPY"]
+    prices = 50 * np.cumprod(1 + rng.normal(0, 0.02, (num_days, len(symbols))), axis=0)
+    df_close = pd.DataFrame(prices, pd.date_range("2011-01-03", periods=num_days), symbols)
+    df_close.iloc[3:6, 3] = np.nan
+    df_close.iloc[20:num_days - 10, 3] = np.nan
+    return df_close
+
+
+def return_diff_events(df_close, symbols, symbol_change, market_change):
+    """Scalar reference for detect_return_diff, one symbol and one date at a time"""
+    close = df_close.values
+    market_close = df_close["SPY"].values
+    events = np.zeros((len(df_close), len(symbols)), dtype=bool)
+    for j, symbol in enumerate(symbols):
+        k = df_close.columns.get_loc(symbol)
+        for i in range(1, len(df_close)):
+            symbol_return = close[i, k] / close[i - 1, k] - 1
+            market_return = market_close[i] / market_close[i - 1] - 1
+            if symbol_change < 0:
+                events[i, j] = symbol_return <= symbol_change and market_return >= market_change
+            else:
+                events[i, j] = symbol_return >= symbol_change and market_return <= market_change
+    return events
+
+
+class TestDetectReturnDiff(unittest.TestCase):
+
+    def test_matches_scalar_reference(self):
+        df_close = make_prices()
+        df_close.iloc[50, 4] = np.nan
+        symbols = ["AAA", "BBB", "CCC", "BAD"]
+        for symbol_change, market_change in [(-0.01, 0.005), (0.01, -0.005)]:
+            df_events = detect_return_diff(symbols, {"Adj Close": df_close}, symbol_change,
+                market_change)
+            expected = return_diff_events(df_close, symbols, symbol_change, market_change)
+            self.assertTrue(expected.any())
+            np.testing.assert_array_equal(df_events[symbols].values == 1, expected)
+            self.assertTrue(df_events["SPY"].isnull().all())
+
+
+class TestDetectEventsSharded(unittest.TestCase):
+
+    def test_matches_detectors(self):
+        df_close = make_prices(num_days=200).rename(columns={"SPY": "MKT"})
+        df_close.iloc[50, 4] = np.nan
+        detectors = [(detect_return_diff, {"symbol_change": -0.01, "market_change": 0.005}),
+            (detect_bollinger, {"window": 10, "symbol_bv_change": -1.0, "market_bv_change": 0.5})]
+        # The market is outside the shards, then inside the last of uneven shards
+        for symbols, num_shards in [(["AAA", "BBB", "CCC", "BAD"], 3), (["BBB", "AAA", "MKT"], 2)]:
+            for detector, kwargs in detectors:
+                expected = detector(symbols, {"Adj Close": df_close}, market_sym="MKT", **kwargs)
+                df_events = detect_events_sharded(detector, symbols, {"Adj Close": df_close},
+                    workers=2, num_shards=num_shards, market_sym="MKT", **kwargs)
+                self.assertTrue((expected[symbols] == 1).any().any())
+                pd.testing.assert_frame_equal(df_events, expected)
+
+
+def bollinger_events(df_close, symbols, window, symbol_bv_change, market_bv_change):
+    """Scalar reference for detect_bollinger, one symbol and one date at a time"""
+    bollinger_val = (df_close - df_close.rolling(window).mean()) / df_close.rolling(window).std()
+    market_bv = bollinger_val["SPY"].values
+    events = np.zeros((len(df_close), len(symbols)), dtype=bool)
+    for j, symbol in enumerate(symbols):
+        symbol_bv = bollinger_val[symbol].values
+        for i in range(window, len(df_close)):
+            if symbol_bv_change < 0:
+                events[i, j] = symbol_bv[i - 1] >= symbol_bv_change and \
+                    symbol_bv[i] <= symbol_bv_change and market_bv[i] >= market_bv_change
+            else:
+                events[i, j] = symbol_bv[i - 1] <= symbol_bv_change and \
+                    symbol_bv[i] >= symbol_bv_change and market_bv[i] <= market_bv_change
+    return events
+
+
+class TestDetectBollinger(unittest.TestCase):
+
+    def test_matches_scalar_reference(self):
+        df_close = make_prices()
+        df_close.iloc[50, 4] = np.nan
+        symbols = ["AAA", "BBB", "CCC", "BAD"]
+        for symbol_bv_change, market_bv_change in [(-1.0, 0.5), (1.0, -0.5)]:
+            df_events = detect_bollinger(symbols, {"Adj Close": df_close}, 10, symbol_bv_change,
+                market_bv_change)
+            expected = bollinger_events(df_close, symbols, 10, symbol_bv_change, market_bv_change)
+            self.assertTrue(expected.any())
+            np.testing.assert_array_equal(df_events[symbols].values == 1, expected)
+
+
+class TestSweepBollinger(unittest.TestCase):
+
+    def check_sweep(self, df_close, symbols, study):
+        """Compare each row of sweep_bollinger with detect_bollinger and the study of its events"""
+        df_sweep = sweep_bollinger(symbols, {"Adj Close": df_close}, windows=(10, 20),
+            symbol_bv_changes=(-1.0, 1.0), market_bv_changes=(0.5, -0.5), num_backward=5,
+            num_forward=5)
+        self.assertEqual(len(df_sweep), 4)
+        for _, row in df_sweep.iterrows():
+            df_events = detect_bollinger(symbols, {"Adj Close": df_close}, int(row["window"]),
+                row["symbol_bv_change"], row["market_bv_change"])
+            num_study_events, mean_return = study(df_events)
+            self.assertEqual(row["num_events"], (df_events[symbols] == 1).sum().sum())
+            self.assertEqual(row["num_study_events"], num_study_events)
+            self.assertAlmostEqual(row["mean_return"], mean_return, places=12)
+
+    def test_matches_event_study(self):
+        df_close = make_prices(num_days=250).ffill().bfill()
+        # A flat stretch, where detect_bollinger finds no spread
+        df_close.iloc[100:130, 0] = df_close.iloc[100, 0]
+
+        def study(df_events):
+            mean_returns, _, num_events = get_event_study(df_events, {"Adj Close": df_close}, 5, 5)
+            return num_events, mean_returns[-1] - 1
+        self.check_sweep(df_close, ["AAA", "BBB", "CCC", "BAD"], study)
+
+    def test_skips_nan_forward_returns(self):
+        df_close = make_prices(num_days=250)
+        df_close.iloc[100:130, 0] = df_close.iloc[100, 0]
+        df_close.iloc[150, 1] = np.nan
+
+        def study(df_events):
+            # Cumulative return of the 5 days after each event, without those holding a NAN
+            all_events_returns = get_event_returns(df_events, {"Adj Close": df_close}, 5, 5)
+            returns = np.prod(all_events_returns[:, 6:] + 1, axis=1) - 1
+            returns = returns[~np.isnan(returns)]
+            return len(returns), np.mean(returns)
+        self.check_sweep(df_close, ["AAA", "BBB", "CCC", "BAD"], study)
+
+
+class TestStreamingBollinger(unittest.TestCase):
+
+    def test_matches_rolling(self):
+        df_close = make_prices()
+        df_close.iloc[50, 4] = np.nan
+        for window in [10, 20]:
+            expected = (df_close - df_close.rolling(window).mean()) / df_close.rolling(window).std()
+            df_bollinger_val = streaming_bollinger_values(df_close, window)
+            np.testing.assert_allclose(df_bollinger_val.values, expected.values, rtol=0, atol=1e-11)
+
+
+def event_returns(df_events, df_close, num_backward, num_forward, market_neutral):
+    """Reference for get_event_returns: the double loop over symbols and dates of plot_events"""
+    df_returns = df_close.pct_change(fill_method=None)
+    df_returns.iloc[0, :] = 0
+    if market_neutral:
+        df_returns = df_returns.sub(df_returns["SPY"].values, axis=0)
+        df_events = df_events.drop(columns=["SPY"])
+    all_events_returns = []
+    for symbol in df_events.columns:
+        for j in range(num_backward, len(df_events) - num_forward):
+            if df_events[symbol].iloc[j] == 1:
+                all_events_returns.append(df_returns[symbol].values[j - num_backward:j + 1 + num_forward])
+    return np.array(all_events_returns).reshape(-1, num_backward + 1 + num_forward)
+
+
+class TestGetEventReturns(unittest.TestCase):
+
+    def test_matches_double_loop(self):
+        df_close = make_prices()
+        df_events = df_close * np.nan
+        df_events.iloc[::3, 0] = 1.0
+        df_events.iloc[1::4, 3] = 1.0
+        df_events.iloc[[0, 5, 60, 119], 1] = 1.0
+        df_events.iloc[30, 4] = 1.0
+        for num_backward, num_forward, market_neutral in [(5, 5, True), (20, 0, True), (3, 7, False)]:
+            all_events_returns = get_event_returns(df_events, {"Adj Close": df_close},
+                num_backward, num_forward, market_neutral)
+            expected = event_returns(df_events, df_close, num_backward, num_forward, market_neutral)
+            self.assertEqual(all_events_returns.shape, expected.shape)
+            np.testing.assert_array_equal(all_events_returns, expected)
+
+
+class TestOutputEventsAsTrades(unittest.TestCase):
+
+    def test_sells_past_last_date_on_last_date(self):
+        dates = pd.DatetimeIndex(get_trading_calendar(dirpath="../../data/dates_lists").dates[100:111])
+        df_events = pd.DataFrame(np.nan, dates, ["AAA", "BBB", "SPY"])
+        df_events.iloc[[2, 8], 0] = 1.0
+        df_events.iloc[10, 1] = 1.0
+
+        df_trades = output_events_as_trades(df_events, None, holding_period=5, shares=50)
+        expected = pd.DataFrame({"Symbol": ["AAA", "AAA", "AAA", "AAA", "BBB", "BBB"],
+            "Order": ["BUY", "SELL", "BUY", "SELL", "BUY", "SELL"], "Shares": 50},
+            index=pd.DatetimeIndex([dates[2], dates[7], dates[8], dates[10], dates[10], dates[10]],
+            name="Date"))
+        pd.testing.assert_frame_equal(df_trades, expected, check_dtype=False)
+
+
+class TestPlaceboEventStudy(unittest.TestCase):
+
+    def test_skips_windows_with_nan_returns(self):
+        df_close = make_prices()
+        df_events = df_close * np.nan
+        df_events.iloc[10::7, :3] = 1.0
+
+        mean_returns, placebo_means, p_values = placebo_event_study(df_events,
+            {"Adj Close": df_close}, num_backward=5, num_forward=5, num_resamples=50,
+            batch_size=20)
+        self.assertFalse(np.isnan(placebo_means).any())
+        self.assertFalse(np.isnan(p_values).any())
+        self.assertEqual(p_values[5], 1.0)
+
+    def test_same_resamples_for_any_workers(self):
+        df_close = make_prices()
+        df_events = df_close * np.nan
+        df_events.iloc[10::7, :3] = 1.0
+
+        results = [placebo_event_study(df_events, {"Adj Close": df_close}, num_backward=5,
+            num_forward=5, num_resamples=50, batch_size=20, workers=workers, executor=executor)
+            for workers, executor in [(1, "thread"), (2, "thread"), (2, "process")]]
+        for result in results[1:]:
+            for expected, actual in zip(results[0], result):
+                np.testing.assert_array_equal(actual, expected)
+
+
+class TestBootstrapEventStudy(unittest.TestCase):
+
+    def test_same_resamples_for_any_workers(self):
+        df_close = make_prices()
+        df_events = df_close * np.nan
+        df_events.iloc[10::7, :3] = 1.0
+        df_events.iloc[12:100:9, 1] = 1.0
+
+        results = [bootstrap_event_study(df_events, {"Adj Close": df_close}, num_backward=5,
+            num_forward=5, num_resamples=250, batch_size=40, seed=3, workers=workers,
+            executor=executor) for workers, executor in [(1, "thread"), (3, "thread"), (2, "process")]]
+        for result in results[1:]:
+            for expected, actual in zip(results[0], result):
+                np.testing.assert_array_equal(actual, expected)
+
+        mean_returns, lower, upper, bootstrap_means = results[0]
+        np.testing.assert_allclose(mean_returns, get_event_study(df_events,
+            {"Adj Close": df_close}, 5, 5)[0], rtol=0, atol=1e-14)
+        self.assertEqual(bootstrap_means.shape, (250, 11))
+        self.assertTrue(np.all(lower <= mean_returns))
+        self.assertTrue(np.all(mean_returns <= upper))
+        self.assertTrue(np.all(lower[6:] < upper[6:]))
+        # The event day is the normalization point of every event
+        self.assertEqual(lower[5], 1.0)
+        self.assertEqual(upper[5], 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+"""Test for util.py"""
+
+
+from util import PriceCache, load_panels, get_data, get_data_as_dict, build_price_store, \
+    open_price_store, price_cache
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+
+
+def write_prices(path, dates, seed):
+    """Write a CSV file of random prices in the layout of the data directory"""
+    rng = np.random.default_rng(seed)
+    prices = 50 * np.cumprod(1 + rng.normal(0, 0.02, (len(dates), 5)), axis=0)
+    df_temp = pd.DataFrame(prices, pd.DatetimeIndex(dates, name="Date"),
+        ["Open", "High", "Low", "Close", "Adj Close"])
+    df_temp.insert(4, "Volume", rng.integers(1000, 9000, len(dates)))
+    # Newest dates first, as in the data directory
+    df_temp.iloc[::-1].to_csv(path)
+
+
+class TempDataTestCase(unittest.TestCase):
+    """Run each test in temp_dir/<name>/a/b, so that the default ../../data is temp_dir/<name>/data"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.addCleanup(os.chdir, os.getcwd())
+        self.dates = pd.bdate_range("2011-01-03", periods=30)
+
+    def make_data_dir(self, name, symbols, seed=0):
+        data_dir = os.path.join(self.temp_dir, name, "data")
+        os.makedirs(data_dir)
+        os.makedirs(os.path.join(self.temp_dir, name, "a", "b"))
+        for i, symbol in enumerate(symbols):
+            write_prices(os.path.join(data_dir, "{}.csv".format(symbol)), self.dates, seed + i)
+        return data_dir
+
+    def work_in(self, name):
+        os.chdir(os.path.join(self.temp_dir, name, "a", "b"))
+
+
+class TestPriceCache(TempDataTestCase):
+
+    def test_keyed_by_path(self):
+        self.make_data_dir("x", ["AAA"], seed=0)
+        self.make_data_dir("y", ["AAA"], seed=1)
+        cache = PriceCache()
+
+        self.work_in("x")
+        df_x = load_panels(self.dates, ["AAA"], ["Adj Close"], None, cache=cache)["Adj Close"]
+        self.work_in("y")
+        df_y = load_panels(self.dates, ["AAA"], ["Adj Close"], None, cache=cache)["Adj Close"]
+        self.assertFalse(np.allclose(df_x.values, df_y.values))
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+
+        self.work_in("x")
+        df_cached = load_panels(self.dates, ["AAA"], ["Adj Close"], None, cache=cache)["Adj Close"]
+        pd.testing.assert_frame_equal(df_cached, df_x)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_stale_entries_are_dropped(self):
+        data_dir = self.make_data_dir("x", ["AAA"])
+        path = os.path.join(data_dir, "AAA.csv")
+        cache = PriceCache()
+        series = pd.Series([1.0, 2.0], self.dates[:2])
+        cache.put("AAA", "Adj Close", series, path, os.path.getmtime(path))
+        self.assertIs(cache.get("AAA", "Adj Close", path), series)
+
+        # Editing the file changes its modification time
+        os.utime(path, (os.path.getmtime(path) + 10, os.path.getmtime(path) + 10))
+        self.assertIsNone(cache.get("AAA", "Adj Close", path))
+        self.assertEqual(cache.nbytes, 0)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_evicts_least_recently_used(self):
+        data_dir = self.make_data_dir("x", ["AAA", "BBB", "CCC"])
+        paths = [os.path.join(data_dir, "{}.csv".format(symbol)) for symbol in ["AAA", "BBB", "CCC"]]
+        series = pd.Series(np.arange(10.0), self.dates[:10])
+        nbytes = int(series.memory_usage(index=True))
+        cache = PriceCache(max_bytes=2 * nbytes)
+
+        cache.put("AAA", "Adj Close", series, paths[0], os.path.getmtime(paths[0]))
+        cache.put("BBB", "Adj Close", series, paths[1], os.path.getmtime(paths[1]))
+        self.assertIsNotNone(cache.get("AAA", "Adj Close", paths[0]))
+        cache.put("CCC", "Adj Close", series, paths[2], os.path.getmtime(paths[2]))
+        self.assertEqual(cache.nbytes, 2 * nbytes)
+        self.assertIsNone(cache.get("BBB", "Adj Close", paths[1]))
+        self.assertIsNotNone(cache.get("AAA", "Adj Close", paths[0]))
+        self.assertIsNotNone(cache.get("CCC", "Adj Close", paths[2]))
+
+        # Entries larger than max_bytes are not kept
+        cache.put("BBB", "Adj Close", pd.concat([series] * 3), paths[1],
+            os.path.getmtime(paths[1]))
+        self.assertIsNone(cache.get("BBB", "Adj Close", paths[1]))
+
+        cache.evict("AAA")
+        self.assertIsNone(cache.get("AAA", "Adj Close", paths[0]))
+        self.assertEqual(cache.nbytes, nbytes)
+        cache.clear()
+        self.assertEqual((cache.nbytes, cache.hits, cache.misses), (0, 0, 0))
+
+
+class TestPriceStore(TempDataTestCase):
+
+    def setUp(self):
+        super(TestPriceStore, self).setUp()
+        self.data_dir = self.make_data_dir("x", ["SPY", "AAA", "BBB", "CCC"])
+        # BBB starts later than the others
+        write_prices(os.path.join(self.data_dir, "BBB.csv"), self.dates[5:], 7)
+        self.store_dir = os.path.join(self.data_dir, "price_store")
+        self.work_in("x")
+        # CCC is only in its CSV file
+        self.store = build_price_store(["SPY", "AAA", "BBB"], self.store_dir)
+
+    def test_same_data_as_csv(self):
+        # Business days are a contiguous range of the store's dates, calendar days are not
+        for dates in [self.dates, self.dates[2:20], pd.date_range("2011-01-01", "2011-02-20")]:
+            # Only CCC is read from CSV
+            misses = price_cache.misses
+            df_store = get_data(["AAA", "BBB", "CCC"], dates, store_dir=self.store_dir)
+            self.assertLessEqual(price_cache.misses, misses + 1)
+            df_csv = get_data(["AAA", "BBB", "CCC"], dates, store_dir=None)
+            pd.testing.assert_frame_equal(df_store, df_csv)
+
+            keys = ["Adj Close", "Volume", "Open"]
+            data_store = get_data_as_dict(dates, ["CCC", "BBB", "SPY"], keys, store_dir=self.store_dir)
+            data_csv = get_data_as_dict(dates, ["CCC", "BBB", "SPY"], keys, store_dir=None)
+            for key in keys:
+                pd.testing.assert_frame_equal(data_store[key], data_csv[key], check_dtype=False)
+
+    def test_newer_csv_file_is_read(self):
+        path = os.path.join(self.data_dir, "AAA.csv")
+        df_before = get_data(["AAA"], self.dates, store_dir=self.store_dir)
+        write_prices(path, self.dates, 11)
+        os.utime(path, (os.path.getmtime(path) + 10, os.path.getmtime(path) + 10))
+
+        self.assertFalse(self.store.is_current("AAA"))
+        self.assertTrue(self.store.is_current("BBB"))
+        df_after = get_data(["AAA"], self.dates, store_dir=self.store_dir)
+        pd.testing.assert_frame_equal(df_after, get_data(["AAA"], self.dates, store_dir=None))
+        self.assertFalse(np.allclose(df_before["AAA"].values, df_after["AAA"].values))
+
+        # Rebuilding the store picks up the new file
+        store = build_price_store(["SPY", "AAA", "BBB"], self.store_dir)
+        self.assertIs(store, open_price_store(self.store_dir))
+        self.assertTrue(store.is_current("AAA"))
+
+    def test_contiguous_slices_are_views(self):
+        df_view = self.store.get_frame(["AAA", "BBB"], self.dates[3:10])
+        self.assertTrue(np.shares_memory(df_view.values, self.store.fields["Adj Close"]))
+        df_copy = self.store.get_frame(["BBB", "SPY"], self.dates[3:10])
+        self.assertFalse(np.shares_memory(df_copy.values, self.store.fields["Adj Close"]))
+        pd.testing.assert_frame_equal(df_view[["BBB"]], df_copy[["BBB"]])
+        self.assertTrue(df_view["BBB"].iloc[:2].isnull().all())
+
+
+if __name__ == '__main__':
+    unittest.main()
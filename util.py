@@ -1,6 +1,9 @@
 """Utility code."""
 
 import os
+import time
+import collections
+import concurrent.futures
 import pandas as pd
 import numpy as np
 import datetime as dt
@@ -12,19 +15,21 @@ def symbol_to_path(symbol, base_dir=os.path.join("../..", "data")):
     return os.path.join(base_dir, "{}.csv".format(str(symbol)))
 
 
-def get_data(symbols, dates, addSPY=True):
-    """Read stock data (adjusted close) for given symbols from CSV files."""
-    df = pd.DataFrame(index=dates)
+def get_data(symbols, dates, addSPY=True, colname="Adj Close",
+    store_dir=os.path.join("../..", "data", "price_store"), workers=1, executor="thread",
+    timings=None):
+    """Read stock data (adjusted close by default) for given symbols.
+
+    Symbols held in the price store at store_dir are sliced from its memory-mapped
+    arrays, unless their CSV files changed after the store was built; all other symbols
+    are read from their CSV files. Pass store_dir=None to always read CSV files. See read_csv_columns for workers, executor and timings.
+    """
     if addSPY and 'SPY' not in symbols:  # add SPY for reference, if absent
         symbols = ['SPY'] + symbols
 
-    for symbol in symbols:
-        df_temp = pd.read_csv(symbol_to_path(symbol), index_col='Date',
-                parse_dates=True, usecols=['Date', 'Adj Close'], na_values=['nan'])
-        df_temp = df_temp.rename(columns={'Adj Close': symbol})
-        df = df.join(df_temp)
-        if symbol == 'SPY':  # drop dates SPY did not trade
-            df = df.dropna(subset=["SPY"])
+    df = load_panels(dates, symbols, [colname], store_dir, workers, executor, timings)[colname]
+    if 'SPY' in symbols:  # drop dates SPY did not trade
+        df = df.dropna(subset=["SPY"])
 
     return df
 
@@ -102,17 +107,110 @@ def get_exchange_days(start_date = dt.datetime(1964,7,5), end_date = dt.datetime
     dates: A list of dates between start_date and end_date on which an exchange traded
     """
 
-    # Load a text file located in dirpath
-    dates_str = load_txt_data(dirpath, filename)
-    all_dates_frome_file = [dt.datetime.strptime(date, "%m/%d/%Y") for date in dates_str]
-    df_all_dates = pd.Series(index=all_dates_frome_file, data=all_dates_frome_file)
-
-    selected_dates = [date for date in df_all_dates[start_date:end_date]]
+    calendar = get_trading_calendar(dirpath, filename)
+    selected_dates = calendar.days_between(start_date, end_date).tolist()
 
     return selected_dates
 
 
-def get_data_as_dict(dates, symbols, keys):
+class TradingCalendar(object):
+    """ The trading days of an exchange, kept as a sorted datetime64 array so that a date 
+    is located by binary search instead of a scan over a list of dates. All lookups accept 
+    a single date or an array of dates.
+    """
+
+    def __init__(self, dates):
+        self.dates = np.unique(pd.DatetimeIndex(dates).values.astype("datetime64[ns]"))
+
+    def __len__(self):
+        return len(self.dates)
+
+    def days_between(self, start_date, end_date):
+        """Return the trading days between start_date and end_date (inclusive) as a DatetimeIndex"""
+        first = np.searchsorted(self.dates, _to_datetime64(start_date), side="left")
+        last = np.searchsorted(self.dates, _to_datetime64(end_date), side="right")
+        return pd.DatetimeIndex(self.dates[first:last])
+
+    def positions(self, dates):
+        """ Return the position of each date in the calendar
+
+        Parameters:
+        dates: A trading day or an array of trading days
+
+        Returns:
+        positions: An int or an array of ints; raise KeyError for dates that are not trading days
+        """
+        values = _to_datetime64(dates)
+        positions = np.searchsorted(self.dates, values)
+        found = (positions < len(self.dates)) & \
+            (self.dates[np.minimum(positions, len(self.dates) - 1)] == values)
+        if not np.all(found):
+            missing = np.atleast_1d(values)[~np.atleast_1d(found)]
+            raise KeyError("Not trading days: {}".format(pd.DatetimeIndex(missing).tolist()))
+        return positions
+
+    def offset(self, start_dates, end_dates):
+        """ Return the number of trading days d with start_date <= d < end_date, which is 
+        the trading-day offset from start_date to end_date when both are trading days. 
+        The result is negative if end_date is before start_date
+        """
+        return np.searchsorted(self.dates, _to_datetime64(end_dates)) - \
+            np.searchsorted(self.dates, _to_datetime64(start_dates))
+
+    def shift(self, dates, n, end_date=None):
+        """ Return the trading day n trading days after each date
+
+        Parameters:
+        dates: A trading day or an array of trading days
+        n: Number of trading days to move forward (backward if negative)
+        end_date: Results falling after this date are moved back to the last trading day 
+        on or before it; by default the last day of the calendar
+
+        Returns:
+        shifted: A Timestamp for a single date, otherwise a DatetimeIndex
+        """
+        last = len(self.dates) - 1
+        if end_date is not None:
+            last = np.searchsorted(self.dates, _to_datetime64(end_date), side="right") - 1
+        shifted = self.dates[np.clip(self.positions(dates) + n, 0, last)]
+        if np.ndim(shifted) == 0:
+            return pd.Timestamp(shifted)
+        return pd.DatetimeIndex(shifted)
+
+
+def _to_datetime64(dates):
+    """Convert a date or an array of dates into datetime64[ns] values"""
+    if np.ndim(dates) == 0:
+        return np.datetime64(pd.Timestamp(dates), "ns")
+    return pd.DatetimeIndex(dates).values.astype("datetime64[ns]")
+
+
+# Calendars loaded so far, keyed by absolute file path
+_trading_calendars = {}
+
+
+def get_trading_calendar(dirpath = "../data/dates_lists", filename="NYSE_dates.txt"):
+    """ Load the trading days listed in a text file (one %m/%d/%Y date per line) into a 
+    TradingCalendar. Each file is parsed once per process
+
+    Parameters:
+    dirpath: The path to the directory where the file is stored
+    filename: The name of the file in the dirpath
+
+    Returns:
+    calendar: A TradingCalendar
+    """
+
+    key = os.path.abspath(os.path.join(dirpath, filename))
+    if key not in _trading_calendars:
+        dates_str = load_txt_data(dirpath, filename)
+        _trading_calendars[key] = TradingCalendar(pd.to_datetime(dates_str, format="%m/%d/%Y"))
+    return _trading_calendars[key]
+
+
+def get_data_as_dict(dates, symbols, keys,
+    store_dir=os.path.join("../..", "data", "price_store"), workers=1, executor="thread",
+    timings=None):
     """ Create a dictionary with types of data (Adj Close, Volume, etc.) as keys. Each value is 
     a dataframe with symbols as columns and dates as rows
 
@@ -120,19 +218,383 @@ def get_data_as_dict(dates, symbols, keys):
     dates: A list of dates of interest
     symbols: A list of symbols of interest
     keys: A list of types of data of interest, e.g. Adj Close, Volume, etc.
+    store_dir: Directory of a price store built by build_price_store; symbols it holds are 
+    not read from CSV. Use None to read CSV files only
+    workers, executor, timings: See read_csv_columns
     
     Returns:
     data_dict: A dictionary whose keys are types of data, e.g. Adj Close, Volume, etc. and 
     values are dataframes with dates as indices and symbols as columns
     """
 
+    return load_panels(dates, symbols, keys, store_dir, workers, executor, timings)
+
+
+def load_panels(dates, symbols, keys, store_dir, workers=1, executor="thread", timings=None,
+    cache=None):
+    """ Load one dataframe per key for the given symbols and dates, from the price store 
+    when it holds the symbol and from CSV files otherwise
+
+    Parameters:
+    dates: A list of dates of interest
+    symbols: A list of symbols of interest
+    keys: A list of types of data of interest, e.g. Adj Close, Volume, etc.
+    store_dir: Directory of a price store built by build_price_store, or None
+    workers, executor, timings: See read_csv_columns
+    cache: The PriceCache holding columns already read from CSV files; price_cache by default
+
+    Returns:
+    data_dict: A dictionary whose keys are types of data and values are dataframes with 
+    dates as indices and symbols as columns
+    """
+
+    if cache is None:
+        cache = price_cache
+    store = open_price_store(store_dir)
+    index = pd.DataFrame(index=dates).index
+
+    # Symbols fully held by the store are not read from CSV files, unless the files are newer
+    csv_symbols = [symbol for symbol in symbols if store is None
+        or not all(store.has(symbol, key) for key in keys) or not store.is_current(symbol)]
+
+    # Take whole columns from the cache, and group the symbols by the keys still missing
+    csv_columns = {}
+    missing = collections.OrderedDict()
+    for symbol in csv_symbols:
+        csv_columns[symbol] = {}
+        for key in keys:
+            series = cache.get(symbol, key)
+            if series is not None:
+                csv_columns[symbol][key] = series
+        missing_keys = tuple(key for key in keys if key not in csv_columns[symbol])
+        if missing_keys:
+            missing.setdefault(missing_keys, []).append(symbol)
+
+    # Read each CSV file once for all its missing keys
+    for missing_keys, missing_symbols in missing.items():
+        paths = [symbol_to_path(symbol) for symbol in missing_symbols]
+        mtimes = [os.path.getmtime(path) for path in paths]
+        frames = read_csv_columns(missing_symbols, missing_keys, workers, executor, timings)
+        for symbol, path, mtime in zip(missing_symbols, paths, mtimes):
+            for key in missing_keys:
+                csv_columns[symbol][key] = frames[symbol][key]
+                cache.put(symbol, key, frames[symbol][key], path, mtime)
+
     data_dict = {}
     for key in keys:
-        df = pd.DataFrame(index=dates)
+        store_symbols = [symbol for symbol in symbols if symbol not in csv_columns]
+        if store_symbols:
+            df_store = store.get_frame(store_symbols, index, key)
+
+        columns = []
         for symbol in symbols:
-            df_temp = pd.read_csv(symbol_to_path(symbol), index_col="Date",
-                    parse_dates=True, usecols=["Date", key], na_values=["nan"])
-            df_temp = df_temp.rename(columns={key: symbol})
-            df = df.join(df_temp) 
-        data_dict[key] = df
+            if symbol in csv_columns:
+                columns.append(csv_columns[symbol][key].reindex(index).rename(symbol))
+            else:
+                columns.append(df_store[symbol])
+        data_dict[key] = assemble_panel(columns, index)
     return data_dict
+
+
+def read_csv_columns(symbols, columns, workers=1, executor="thread", timings=None):
+    """ Read the given columns from the CSV file of each symbol, parsing each file only once
+
+    Parameters:
+    symbols: A list of symbols of interest
+    columns: A list of types of data of interest, e.g. Adj Close, Volume, etc.
+    workers, executor: See map_tasks; a process pool also spreads the CSV parsing
+    timings: An optional dictionary that is filled with the seconds spent reading each 
+    symbol, to spot slow files
+    
+    Returns:
+    frames: A dictionary whose keys are symbols and values are dataframes with dates as 
+    indices and the given columns
+    """
+
+    usecols = ["Date"] + list(columns)
+    results = map_tasks(_read_symbol_csv, [(symbol_to_path(symbol), usecols) for symbol in symbols],
+        workers, executor)
+
+    frames = {}
+    for symbol, (df_temp, seconds) in zip(symbols, results):
+        frames[symbol] = df_temp
+        if timings is not None:
+            timings[symbol] = seconds
+    return frames
+
+
+def _read_symbol_csv(task):
+    """Read the columns usecols of one CSV file and return them with the seconds it took"""
+    path, usecols = task
+    start = time.time()
+    df_temp = pd.read_csv(path, index_col="Date", parse_dates=True, usecols=usecols,
+            na_values=["nan"])
+    return df_temp, time.time() - start
+
+
+def map_tasks(func, tasks, workers=1, executor="thread"):
+    """ Run func on every task and return the results in the order of tasks
+
+    Parameters:
+    func: A function of one argument; it must be defined at module level for a process pool
+    tasks: A list of arguments of func
+    workers: Number of tasks run at the same time; 1 runs them one after another in this 
+    process
+    executor: "thread" for a thread pool, which suits file I/O and numpy code that releases 
+    the GIL, or "process" for a process pool, which pickles each task and its result
+
+    Returns:
+    results: A list of the results of func
+    """
+
+    if workers > 1 and len(tasks) > 1:
+        if executor == "thread":
+            pool_class = concurrent.futures.ThreadPoolExecutor
+        elif executor == "process":
+            pool_class = concurrent.futures.ProcessPoolExecutor
+        else:
+            raise ValueError("executor must be 'thread' or 'process', got {}".format(executor))
+        with pool_class(max_workers=workers) as pool:
+            return list(pool.map(func, tasks))
+    return [func(task) for task in tasks]
+
+
+def assemble_panel(columns, index):
+    """ Build a dataframe from a list of series that are already aligned on index, using 
+    a single concatenation instead of one join per series
+
+    Parameters:
+    columns: A list of series, each named after its symbol and indexed by index
+    index: The index of the dataframe, e.g. the dates of interest
+
+    Returns:
+    df: A dataframe with index as indices and one column per series
+    """
+
+    if len(columns) == 0:
+        return pd.DataFrame(index=index)
+    return pd.concat(columns, axis=1)
+
+
+class PriceCache(object):
+    """ An in-process LRU cache of price columns read from CSV files, keyed by the absolute 
+    path of the file and the type of data (Adj Close, Volume, etc.), so that the same symbol 
+    read from another data directory, or after a change of directory, is not mixed up.
+
+    Each entry holds the whole column of a file, so any date range is served by slicing 
+    it instead of reading the file again. An entry is dropped when its file's modification 
+    time changes, and the least recently used entries are evicted once the cache holds 
+    more than max_bytes. A cache with max_bytes=0 keeps nothing.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+
+    def get(self, symbol, field, path=None):
+        """Return the cached column of symbol for field read from path, symbol_to_path(symbol) 
+        by default, or None if absent or stale"""
+        key = (os.path.abspath(path or symbol_to_path(symbol)), field)
+        if key in self._entries:
+            _, mtime, series, _ = self._entries[key]
+            if os.path.exists(key[0]) and os.path.getmtime(key[0]) == mtime:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return series
+            self._pop(key)
+        self.misses += 1
+        return None
+
+    def put(self, symbol, field, series, path, mtime):
+        """Cache the whole column of symbol for field, read from path at modification time mtime"""
+        key = (os.path.abspath(path), field)
+        if key in self._entries:
+            self._pop(key)
+        nbytes = int(series.memory_usage(index=True))
+        if nbytes > self.max_bytes:
+            return
+        self._entries[key] = (symbol, mtime, series, nbytes)
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes:
+            self._pop(next(iter(self._entries)))
+
+    def evict(self, symbol=None, field=None):
+        """Drop the entries matching symbol and field, from any directory; None matches any value"""
+        for key, entry in list(self._entries.items()):
+            if symbol in (None, entry[0]) and field in (None, key[1]):
+                self._pop(key)
+
+    def clear(self):
+        """Drop all entries and reset the hit and miss counters"""
+        self.evict()
+        self.hits = 0
+        self.misses = 0
+
+    def _pop(self, key):
+        self.nbytes -= self._entries.pop(key)[3]
+
+
+# The cache used by get_data and get_data_as_dict
+price_cache = PriceCache()
+
+
+PRICE_FIELDS = ["Open", "High", "Low", "Close", "Volume", "Adj Close"]
+
+# Price stores opened so far, keyed by absolute directory path
+_price_stores = {}
+
+
+class PriceStore(object):
+    """ A read-only columnar store of daily price data for many symbols.
+
+    Each field (Open, High, Low, Close, Volume, Adj Close) is kept in its own float64 .npy 
+    file of shape (number of dates, number of symbols), opened as a memory map. The rows 
+    share one sorted date axis (dates.npy) and the columns one symbol index (symbols.npy), 
+    so looking up a symbol or a date never parses text and only the requested cells are 
+    read from disk. The path and modification time of each symbol's CSV file are recorded 
+    (sources.npy and mtimes.npy), so that a CSV file edited after the build is detected.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.dates = np.load(os.path.join(store_dir, "dates.npy")).astype("datetime64[ns]")
+        self.symbols = np.load(os.path.join(store_dir, "symbols.npy")).tolist()
+        self.symbol_index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.sources = dict(zip(self.symbols, zip(
+            np.load(os.path.join(store_dir, "sources.npy")).tolist(),
+            np.load(os.path.join(store_dir, "mtimes.npy")).tolist())))
+        self.fields = {}
+        for field in np.load(os.path.join(store_dir, "fields.npy")).tolist():
+            self.fields[field] = np.load(_field_path(store_dir, field), mmap_mode="r")
+
+    def has(self, symbol, field="Adj Close"):
+        """Return True if the store holds the given field for symbol"""
+        return field in self.fields and symbol in self.symbol_index
+
+    def is_current(self, symbol):
+        """Return False if the CSV file of symbol was modified after the store was built"""
+        path, mtime = self.sources[symbol]
+        return not os.path.exists(path) or os.path.getmtime(path) <= mtime
+
+    def get_frame(self, symbols, dates, field="Adj Close"):
+        """
+        Slice a field of the store for the given symbols and dates
+
+        Parameters:
+        symbols: A list of symbols held by the store
+        dates: A list of dates of interest
+        field: Type of data of interest, e.g. Adj Close, Volume, etc.
+
+        Returns:
+        df: A dataframe with dates as indices and symbols as columns. Dates on which a 
+        symbol has no data are NAN's, as when joining its CSV file. If the dates are a 
+        contiguous range of the store's dates and the symbols consecutive columns of the 
+        store, df wraps a read-only view of the memory map and nothing is copied
+        """
+        index = pd.DatetimeIndex(dates)
+        wanted = index.values.astype("datetime64[ns]")
+        rows = np.searchsorted(self.dates, wanted)
+        cols = [self.symbol_index[symbol] for symbol in symbols]
+
+        # A contiguous range of the store's dates is a slice of the memory map, and so are 
+        # consecutive symbols; other symbols only copy the requested cells
+        first = rows[0] if len(rows) > 0 else 0
+        if len(rows) > 0 and np.array_equal(self.dates[first:first + len(rows)], wanted):
+            block = self.fields[field][first:first + len(rows)]
+            if len(cols) > 0 and cols == list(range(cols[0], cols[0] + len(cols))):
+                return pd.DataFrame(block[:, cols[0]:cols[0] + len(cols)], index=dates,
+                    columns=symbols, copy=False)
+            return pd.DataFrame(block[:, cols], index=dates, columns=symbols, copy=False)
+
+        rows = np.minimum(rows, len(self.dates) - 1)
+        found = self.dates[rows] == wanted if len(self.dates) > 0 else np.zeros(len(wanted), bool)
+
+        values = np.full((len(wanted), len(cols)), np.nan)
+        values[found] = self.fields[field][rows[found][:, None], cols]
+        return pd.DataFrame(values, index=dates, columns=symbols, copy=False)
+
+
+def _field_path(store_dir, field):
+    """Return the .npy file path of a field in a price store"""
+    return os.path.join(store_dir, "{}.npy".format(field.replace(" ", "_")))
+
+
+def build_price_store(symbols, store_dir=os.path.join("../..", "data", "price_store"),
+    fields=PRICE_FIELDS):
+    """ Convert the CSV files of symbols into a memory-mapped price store. This only has 
+    to be run once; afterwards get_data and get_data_as_dict serve these symbols from the 
+    store. Symbols whose CSV files change later are read from CSV until the store is rebuilt
+
+    Parameters:
+    symbols: A list of symbols whose CSV files are converted
+    store_dir: The path to the directory where the store is written
+    fields: A list of types of data to store, e.g. Adj Close, Volume, etc.
+
+    Returns:
+    store: The PriceStore that was written
+    """
+
+    if not os.path.exists(store_dir):
+        os.makedirs(store_dir)
+
+    # Each CSV file is parsed once for all fields. Its modification time is taken before 
+    # reading it, so that an edit during the build is not missed
+    frames = []
+    sources = []
+    mtimes = []
+    for symbol in symbols:
+        sources.append(os.path.abspath(symbol_to_path(symbol)))
+        mtimes.append(os.path.getmtime(sources[-1]))
+        df_temp = pd.read_csv(sources[-1], index_col="Date",
+                parse_dates=True, usecols=["Date"] + list(fields), na_values=["nan"])
+        frames.append(df_temp[~df_temp.index.duplicated()])
+
+    # The shared date axis is the sorted union of all dates found in the files
+    dates = pd.DatetimeIndex([])
+    for df_temp in frames:
+        dates = dates.union(df_temp.index)
+    dates = dates.sort_values()
+    np.save(os.path.join(store_dir, "dates.npy"), dates.values.astype("datetime64[ns]"))
+    np.save(os.path.join(store_dir, "symbols.npy"), np.array(symbols, dtype=str))
+    np.save(os.path.join(store_dir, "sources.npy"), np.array(sources, dtype=str))
+    np.save(os.path.join(store_dir, "mtimes.npy"), np.array(mtimes, dtype=np.float64))
+
+    for field in fields:
+        values = np.lib.format.open_memmap(_field_path(store_dir, field), mode="w+",
+            dtype=np.float64, shape=(len(dates), len(symbols)))
+        for i, df_temp in enumerate(frames):
+            values[:, i] = df_temp[field].reindex(dates).values
+        values.flush()
+        del values
+
+    # fields.npy is written last and marks the store as complete
+    np.save(os.path.join(store_dir, "fields.npy"), np.array(fields, dtype=str))
+    _price_stores.pop(os.path.abspath(store_dir), None)
+    return open_price_store(store_dir)
+
+
+def open_price_store(store_dir=os.path.join("../..", "data", "price_store")):
+    """ Open the price store in store_dir. A store is opened once per process and reused 
+    until its files are rewritten
+
+    Parameters:
+    store_dir: The path to the directory of the store
+
+    Returns:
+    store: A PriceStore, or None if store_dir is None or does not hold a complete store
+    """
+
+    if store_dir is None:
+        return None
+    marker = os.path.join(store_dir, "fields.npy")
+    if not os.path.exists(marker):
+        return None
+
+    key = os.path.abspath(store_dir)
+    mtime = os.path.getmtime(marker)
+    if key not in _price_stores or _price_stores[key][0] != mtime:
+        _price_stores[key] = (mtime, PriceStore(store_dir))
+    return _price_stores[key][1]